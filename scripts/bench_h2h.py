@@ -0,0 +1,335 @@
+#!/usr/bin/env .venv/bin/python3
+
+# Benchmarks the translator on a synthetic corpus of help files, generated from a fixed
+# seed so that no Vim checkout is needed. Checks the output against the golden SHA-256
+# hashes stored in the baseline file, and the timings against the baseline timings.
+# After an intentional change to the output, or to record timings on a new machine,
+# rerun with --update-baseline. Meant to be run from the top-level directory of the
+# repository, as 'scripts/bench_h2h.py', like 'scripts/h2h.py'.
+
+import argparse
+import hashlib
+import json
+import pathlib
+import random
+import sys
+import time
+
+root_path = pathlib.Path(__file__).parent.parent
+
+sys.path.append(str(root_path))
+
+from vimhelp.vimh2h import ENGINES, VimH2H  # noqa: E402
+
+DEFAULT_BASELINE = pathlib.Path(__file__).parent / "bench_h2h_baseline.json"
+
+SEED = 20240101
+
+# Synthetic files: name and approximate size in bytes. "options.txt" stands in for
+# the largest real help file.
+CORPUS_FILES = (
+    ("help.txt", 10_000),
+    ("intro.txt", 40_000),
+    ("usr_01.txt", 30_000),
+    ("motion.txt", 80_000),
+    ("eval.txt", 150_000),
+    ("options.txt", 420_000),
+    *((f"gen_{i:02}.txt", 20_000) for i in range(20)),
+)
+
+# Timings of files that the baseline translates faster than this are too noisy to
+# check individually; they still count towards the total.
+MIN_CHECKED_SECS = 0.02
+
+WORDS = (
+    "the", "a", "to", "is", "of", "and", "in", "be", "cursor", "buffer", "window",
+    "line", "text", "command", "option", "mode", "file", "register", "mark", "when",
+    "used", "with", "this", "that", "for", "not", "can", "Insert", "Normal", "Visual",
+    "character", "screen", "search", "pattern", "value", "default", "see", "also",
+    "können", "naïve", "résumé",
+)  # fmt: skip
+OPTIONS = (
+    "autoindent", "background", "compatible", "expandtab", "filetype", "hlsearch",
+    "ignorecase", "number", "shiftwidth", "tabstop", "textwidth", "wrap",
+)  # fmt: skip
+KEYS = "<CR>", "<Esc>", "<Tab>", "<BS>", "<C-W>", "<Leader>", "<S-Up>", "<M-x>"
+SPECIALS = "{char}", "{motion}", "[count]", "[range]", "{lhs}", "[++opt]"
+CTRLS = "CTRL-A", "CTRL-W_j", "CTRL-V", "CTRL-]", "CTRL-{char}", "META-x", "ALT-<Tab>"
+EXAMPLES = (
+    ":set ts=8 sw=4 et",
+    "let x = a < b && c > d",
+    "nnoremap <Leader>w :w<CR>",
+    "if has('unix') | echo \"& ok\" | endif",
+    "\tcall setline(1, ['<html>', '&amp;'])",
+    "vim9script",
+    "def F(): number",
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the translator on a synthetic help corpus"
+    )
+    parser.add_argument(
+        "--engine",
+        "-e",
+        choices=ENGINES,
+        default="lexer",
+        help="Translator engine (default: lexer)",
+    )
+    parser.add_argument(
+        "--repeat",
+        "-r",
+        type=int,
+        default=5,
+        help="Number of runs; the fastest one counts (default: 5)",
+    )
+    parser.add_argument(
+        "--tolerance",
+        "-t",
+        type=float,
+        default=0.2,
+        help="Allowed slowdown relative to the baseline (default: 0.2, i.e. 20%%)",
+    )
+    parser.add_argument(
+        "--baseline",
+        "-b",
+        type=pathlib.Path,
+        default=DEFAULT_BASELINE,
+        help=f"Baseline file (default: {DEFAULT_BASELINE.relative_to(root_path)})",
+    )
+    parser.add_argument(
+        "--update-baseline",
+        "-u",
+        action="store_true",
+        help="Write the results to the baseline file instead of checking them",
+    )
+    parser.add_argument(
+        "--out-dir",
+        "-o",
+        type=pathlib.Path,
+        help="Also write the synthetic corpus to the given directory",
+    )
+    args = parser.parse_args()
+
+    corpus = generate_corpus(SEED)
+    if args.out_dir is not None:
+        args.out_dir.mkdir(exist_ok=True)
+        for name, content in corpus.items():
+            (args.out_dir / name).write_text(content)
+
+    num_bytes = sum(len(content.encode()) for content in corpus.values())
+    print(f"Synthetic corpus: {len(corpus)} files, {num_bytes} bytes")
+
+    results = run(corpus, args.engine, args.repeat)
+
+    if args.update_baseline:
+        with args.baseline.open("w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Wrote baseline to {args.baseline}")
+        return
+
+    baseline = json.loads(args.baseline.read_text())
+    num_failures = check(results, baseline, args.tolerance)
+    if num_failures > 0:
+        sys.exit(f"{num_failures} check(s) failed")
+    print("All checks passed.")
+
+
+def run(corpus, engine, repeat):
+    timings = {"__init__": [], "add_tags": [], "to_html": {}}
+    golden = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        h2h = VimH2H(mode="offline", project="vim", tags=corpus["tags"], engine=engine)
+        timings["__init__"].append(time.perf_counter() - start)
+
+        no_tags_h2h = VimH2H(mode="offline", project="vim", engine=engine)
+        start = time.perf_counter()
+        for name, content in corpus.items():
+            if name != "tags":
+                no_tags_h2h.add_tags(name, content)
+        timings["add_tags"].append(time.perf_counter() - start)
+
+        for name, content in corpus.items():
+            start = time.perf_counter()
+            html = h2h.to_html(name, content)
+            timings["to_html"].setdefault(name, []).append(time.perf_counter() - start)
+            golden[name] = hashlib.sha256(html.encode()).hexdigest()
+
+    to_html = {name: min(secs) for name, secs in timings["to_html"].items()}
+    return {
+        "engine": engine,
+        "golden": golden,
+        "timings": {
+            "__init__": min(timings["__init__"]),
+            "add_tags": min(timings["add_tags"]),
+            "to_html": to_html,
+            "to_html_total": sum(to_html.values()),
+        },
+    }
+
+
+def check(results, baseline, tolerance):
+    num_failures = 0
+
+    for name, digest in results["golden"].items():
+        if baseline["golden"].get(name) != digest:
+            print(f"  {name}: output differs from golden output")
+            num_failures += 1
+
+    if results["engine"] != baseline["engine"]:
+        print(f"Not comparing timings: baseline is for the {baseline['engine']} engine")
+        return num_failures
+
+    timings = results["timings"]
+    base_timings = baseline["timings"]
+    rows = [
+        (label, timings[label], base_timings[label], True)
+        for label in ("__init__", "add_tags", "to_html_total")
+    ]
+    for name, secs in timings["to_html"].items():
+        base_secs = base_timings["to_html"][name]
+        rows.append((f"to_html {name}", secs, base_secs, base_secs >= MIN_CHECKED_SECS))
+    print(f"{'':28} {'now':>10} {'baseline':>10}")
+    for label, secs, base_secs, is_checked in rows:
+        ratio = secs / base_secs
+        flag = ""
+        if not is_checked:
+            flag = "  (not checked)"
+        elif ratio > 1 + tolerance:
+            flag = "  SLOWER"
+            num_failures += 1
+        print(f"  {label:26} {secs:10.4f} {base_secs:10.4f} {ratio:6.2f}x{flag}")
+    return num_failures
+
+
+def generate_corpus(seed):
+    """
+    Return a dict mapping file names to contents: the files in CORPUS_FILES, and a
+    tags file for all the tags they define.
+    """
+    rng = random.Random(seed)  # noqa: S311
+    # Tags of each file are decided up front, so that links can point at any file
+    file_tags = {}
+    for name, size in CORPUS_FILES:
+        words = rng.choices(WORDS + OPTIONS, k=max(4, size // 600))
+        file_tags[name] = [
+            name,
+            *(f"{name[:-4]}-{word}-{i}" for i, word in enumerate(words)),
+        ]
+    file_tags["options.txt"][1:1] = [f"'{opt}'" for opt in OPTIONS]
+    all_tags = [tag for tags in file_tags.values() for tag in tags]
+    corpus = {
+        name: generate_file(rng, name, size, file_tags[name], all_tags)
+        for name, size in CORPUS_FILES
+    }
+    tag_lines = sorted(
+        f"{tag}\t{name}\t/*{tag}*" for name, tags in file_tags.items() for tag in tags
+    )
+    corpus["tags"] = "\n".join(tag_lines) + "\n"
+    return corpus
+
+
+def generate_file(rng, name, size, tags, all_tags):
+    lines = [
+        f"*{name}*\tFor Vim version 9.1.  Last change: 2024 Jan 01",
+        "",
+        "",
+        "\t\t  VIM REFERENCE MANUAL    by Bram Moolenaar",
+        "",
+        "",
+    ]
+    own_tags = iter(tags[1:])
+    num_bytes = 0
+    section = 0
+    while num_bytes < size:
+        section += 1
+        block = generate_section(rng, section, own_tags, all_tags)
+        num_bytes += sum(len(line) + 1 for line in block)
+        lines += block
+    lines += ["", " vim:tw=78:ts=8:noet:ft=help:norl:"]
+    return "\n".join(lines) + "\n"
+
+
+def generate_section(rng, section, own_tags, all_tags):
+    title = " ".join(rng.choices(WORDS, k=3)).title()
+    lines = [
+        "=" * 78,
+        star_line(f"{section}. {title}", next(own_tags, None)),
+        "",
+    ]
+    for _ in range(rng.randint(3, 12)):
+        kind = rng.random()
+        if kind < 0.15:
+            lines.append(star_line(rng.choice(WORDS).upper() + " ~", None))
+        elif kind < 0.35:
+            tag = next(own_tags, None)
+            command = ":" + rng.choice(WORDS) + rng.choice(("", "!", " {arg}"))
+            lines.append(star_line(command, tag))
+        elif kind < 0.55:
+            lines += generate_example(rng)
+        elif kind < 0.6:
+            lines.append("-" * 78)
+        lines += generate_paragraph(rng, all_tags)
+        lines.append("")
+    return lines
+
+
+def star_line(text, tag):
+    if tag is None:
+        return text
+    star = f"*{tag}*"
+    padding = max(1, 78 - len(text) - len(star))
+    return text + " " * padding + star
+
+
+def generate_example(rng):
+    intro = " ".join(rng.choices(WORDS, k=rng.randint(3, 8))).capitalize()
+    lines = [intro + ": " + rng.choice((">", ">vim", ">lua"))]
+    lines += ["\t" + rng.choice(EXAMPLES) for _ in range(rng.randint(1, 6))]
+    lines.append(rng.choice(("<", "", "<\tafter")))
+    return lines
+
+
+def generate_paragraph(rng, all_tags):
+    words = []
+    for _ in range(rng.randint(20, 120)):
+        kind = rng.random()
+        if kind < 0.06:
+            words.append(f"|{rng.choice(all_tags)}|")
+        elif kind < 0.07:
+            words.append(f"|{rng.choice(WORDS)}-missing|")
+        elif kind < 0.1:
+            words.append(f"'{rng.choice(OPTIONS)}'")
+        elif kind < 0.12:
+            words.append(rng.choice(KEYS))
+        elif kind < 0.14:
+            words.append(rng.choice(SPECIALS))
+        elif kind < 0.16:
+            words.append(rng.choice(CTRLS))
+        elif kind < 0.17:
+            words.append(f"`:{rng.choice(WORDS)}`")
+        elif kind < 0.175:
+            words.append(rng.choice(("Note:", "NOTE", "Notes:")))
+        elif kind < 0.178:
+            words.append(f"https://example.org/{rng.choice(WORDS)}?a=1&b=2")
+        elif kind < 0.18:
+            words.append(f"*{rng.choice(WORDS)}-inline*")
+        elif kind < 0.2:
+            words.append(rng.choice(WORDS) + rng.choice((".", ",", ";", " &", " <")))
+        else:
+            words.append(rng.choice(WORDS))
+    lines = []
+    line = ""
+    for word in words:
+        if len(line) + len(word) >= 78:
+            lines.append(line)
+            line = "\t" if rng.random() < 0.1 else ""
+        line = f"{line} {word}" if line.strip() else line + word
+    lines.append(line)
+    return lines
+
+
+main()
@@ -5,17 +5,84 @@
 # (use "inv venv" to create it).
 
 import argparse
+import base64
+import gc
+import gzip
+import hashlib
+import itertools
+import json
+import mimetypes
+import multiprocessing
+import os
 import os.path
 import pathlib
+import sqlite3
 import sys
+import time
+import zlib
 
-import flask
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    from compression import zstd
+except ImportError:
+    zstd = None
 
 root_path = pathlib.Path(__file__).parent.parent
 
 sys.path.append(str(root_path))
 
-from vimhelp.vimh2h import VimH2H  # noqa: E402
+from vimhelp.bundle import BUNDLE_SCHEMA, BUNDLE_VERSION  # noqa: E402
+from vimhelp.vimh2h import ENGINES, VimH2H, render_template  # noqa: E402
+
+# Build manifest in the output directory, which records what each output file was
+# made from, so that files whose inputs have not changed need not be translated again
+MANIFEST_NAME = ".h2h-manifest.json"
+MANIFEST_VERSION = 1
+
+# Seconds between checks of the input directory for changes, with --watch
+WATCH_INTERVAL = 0.2
+
+# Manifest of the files of an --export, with the headers to serve them with
+EXPORT_MANIFEST_NAME = "export-manifest.json"
+PAGE_CACHE_CONTROL = "public, max-age=900"
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# zlib window bits that make 'zlib.compressobj' write the gzip format
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class _BrotliCompressor:
+    # 'brotli.Compressor' with the interface of the other compressors
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=11)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+# Content encoding, file name suffix and compressor factory of each kind of
+# precompressed sibling that --export writes next to each file, if available; the
+# compressors have 'compress' and 'flush' methods like those of 'zlib.compressobj'
+COMPRESSIONS = [
+    ("gzip", ".gz", lambda: zlib.compressobj(9, wbits=GZIP_WBITS)),
+]
+if brotli is not None:
+    COMPRESSIONS.append(("br", ".br", _BrotliCompressor))
+if zstd is not None:
+    COMPRESSIONS.append(("zstd", ".zst", lambda: zstd.ZstdCompressor(level=19)))
+SIBLING_SUFFIXES = ".gz", ".br", ".zst"
+
+# Size of the blocks in which output files are read to compress or compare them
+BLOCK_SIZE = 256 * 1024
+
+# With --export, maps the name of each static asset to its fingerprinted file name
+_export_asset_names = {}
 
 
 def main():
@@ -46,6 +113,21 @@ def main():
         action="store_true",
         help="Generate the web version of the files (default: offline version)",
     )
+    parser.add_argument(
+        "--export",
+        "-X",
+        action="store_true",
+        help="Export a deployable web version: assets with fingerprinted names, "
+        "precompressed siblings of every file and a manifest of cache headers "
+        "(implies --web-version)",
+    )
+    parser.add_argument(
+        "--bundle",
+        "-B",
+        type=pathlib.Path,
+        help="Also pack the output directory into the given single-file bundle, "
+        "which scripts/h2h_serve.py can serve",
+    )
     parser.add_argument(
         "--theme",
         "-t",
@@ -58,89 +140,700 @@ def main():
         action="store_true",
         help="Ignore any tags file, always recreate tags from scratch",
     )
+    parser.add_argument(
+        "--engine",
+        "-e",
+        choices=ENGINES,
+        default="lexer",
+        help="Translator engine (default: lexer)",
+    )
+    parser.add_argument(
+        "--compact",
+        "-C",
+        action="store_true",
+        help="Generate compact HTML, and report the bytes saved per file",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of files to translate in parallel (default: 1; 0: one per CPU)",
+    )
+    parser.add_argument(
+        "--force",
+        "-f",
+        action="store_true",
+        help="Translate all files, even those that the build manifest says are current",
+    )
+    parser.add_argument(
+        "--watch",
+        "-W",
+        action="store_true",
+        help="After translating, keep watching the input directory, and retranslate "
+        "the files affected by each change",
+    )
     parser.add_argument(
         "--profile", "-P", action="store_true", help="Profile performance"
     )
+    parser.add_argument(
+        "--profile-json",
+        "-J",
+        type=pathlib.Path,
+        help="Write translator profiling data to the given file as JSON",
+    )
     parser.add_argument(
         "basenames", nargs="*", help="List of files to process (default: all)"
     )
     args = parser.parse_args()
+    if args.jobs == 0:
+        args.jobs = os.cpu_count()
+    if args.jobs > 1 and args.profile:
+        parser.error("--profile only works with a single job")
+    if args.watch and args.out_dir is None:
+        parser.error("--watch requires --out-dir")
+    if args.export:
+        if args.out_dir is None:
+            parser.error("--export requires --out-dir")
+        args.web_version = True
+    if args.bundle is not None and args.out_dir is None:
+        parser.error("--bundle requires --out-dir")
 
-    app = flask.Flask(
-        __name__,
-        root_path=str(pathlib.Path(__file__).resolve().parent),
-        template_folder="../vimhelp/templates",
-    )
-    app.jinja_options["trim_blocks"] = True
-    app.jinja_options["lstrip_blocks"] = True
-    app.jinja_env.filters["static_path"] = lambda p: p
-
-    with app.app_context():
-        if args.profile:
-            import cProfile
-            import pstats
+    if args.profile:
+        import cProfile
+        import pstats
 
-            with cProfile.Profile() as pr:
-                run(args)
-            stats = pstats.Stats(pr).sort_stats("cumulative")
-            stats.print_stats()
-        else:
+        with cProfile.Profile() as pr:
             run(args)
+        stats = pstats.Stats(pr).sort_stats("cumulative")
+        stats.print_stats()
+    else:
+        run(args)
 
 
 def run(args):
     if not args.in_dir.is_dir():
         raise RuntimeError(f"{args.in_dir} is not a directory")
 
-    prelude = VimH2H.prelude(theme=args.theme)
+    prelude = VimH2H.prelude(theme=args.theme).encode()
 
     mode = "hybrid" if args.web_version else "offline"
 
-    if not args.no_tags and (tags_file := args.in_dir / "tags").is_file():
-        print("Processing tags file...")
-        h2h = VimH2H(mode=mode, project=args.project, tags=tags_file.read_text())
-        faq = args.in_dir / "vim_faq.txt"
-        if faq.is_file():
-            print("Processing FAQ tags...")
-            h2h.add_tags(faq.name, faq.read_text())
-    else:
-        print("Initializing tags...")
-        h2h = VimH2H(mode=mode, project=args.project)
-        for infile in args.in_dir.iterdir():
-            if infile.suffix == ".txt":
-                h2h.add_tags(infile.name, infile.read_text())
+    if args.export:
+        args.out_dir.mkdir(exist_ok=True)
+        print("Creating fingerprinted static files...")
+        export_assets(args.out_dir, mode)
 
+    h2h = make_translator(args, mode)
+
+    manifest = None
     if args.out_dir is not None:
         args.out_dir.mkdir(exist_ok=True)
+        inputs = build_inputs(args, mode, h2h, prelude)
+        manifest = load_manifest(args.out_dir, inputs, args.force)
 
+    infiles = []
+    source_hashes = {}
+    num_current = 0
     for infile in args.in_dir.iterdir():
         if len(args.basenames) != 0 and infile.name not in args.basenames:
             continue
         if infile.suffix != ".txt" and infile.name != "tags":
             print(f"Ignoring {infile}")
             continue
-        content = infile.read_text()
-        print(f"Processing {infile}...")
-        html = h2h.to_html(infile.name, content)
-        if args.out_dir is not None:
-            with (args.out_dir / f"{infile.name}.html").open("w") as f:
-                f.write(prelude)
-                f.write(html)
+        if manifest is not None:
+            source_hash = hashlib.sha256(infile.read_bytes()).hexdigest()
+            outfile = args.out_dir / f"{infile.name}.html"
+            if manifest["files"].get(outfile.name) == source_hash and outfile.exists():
+                num_current += 1
+                continue
+            source_hashes[infile.name] = source_hash
+        infiles.append(infile)
+    if num_current > 0:
+        print(f"Skipping {num_current} file(s) that are already up to date")
+
+    compact_savings = {}
+    profile = h2h.profile_stats()
+    if args.jobs > 1:
+        # Largest files first, so that no worker is left with a large one at the end
+        infiles.sort(key=lambda infile: infile.stat().st_size, reverse=True)
+        results = translate_parallel(
+            h2h, infiles, args.out_dir, prelude, args.export, args.jobs
+        )
+    else:
+        results = (
+            translate_file(h2h, infile, args.out_dir, prelude, args.export)
+            for infile in infiles
+        )
+    for name, saved, file_profile in results:
+        if saved is not None:
+            compact_savings[name] = saved
+            print(f"Compact mode saved {saved} bytes on {name}")
+        if file_profile is not None:
+            add_profile(profile, file_profile)
+        if manifest is not None:
+            manifest["files"][f"{name}.html"] = source_hashes[name]
 
     if args.out_dir is not None:
+        if len(args.basenames) == 0:
+            remove_stale_outputs(args.out_dir, manifest, args.in_dir)
+        save_manifest(args.out_dir, manifest)
+
+    if args.export:
+        print(f"Writing {EXPORT_MANIFEST_NAME}...")
+        write_export_manifest(args.out_dir)
+    elif args.out_dir is not None:
         print("Symlinking/creating static files...")
         static_dir = root_path / "vimhelp" / "static"
         static_dir_rel = os.path.relpath(static_dir, args.out_dir)
         for target in static_dir.iterdir():
             target_name = target.name
             src = args.out_dir / target_name
+            link = f"{static_dir_rel}/{target_name}"
+            if src.is_symlink() and str(src.readlink()) == link:
+                continue
             src.unlink(missing_ok=True)
-            src.symlink_to(f"{static_dir_rel}/{target_name}")
+            src.symlink_to(link)
         for name in "vimhelp.css", "vimhelp.js":
-            content = flask.render_template(name, mode=mode)
-            (args.out_dir / name).write_text(content)
+            content = render_template(name, mode=mode)
+            write_if_changed(args.out_dir / name, content.encode())
+
+    if args.bundle is not None:
+        print(f"Writing bundle {args.bundle}...")
+        write_bundle(args.bundle, args.out_dir, h2h, mode, args.project)
+
+    if args.compact:
+        total_saved = sum(compact_savings.values())
+        print(f"Compact mode saved {total_saved} bytes in total")
+
+    if args.profile:
+        print("Translator cache stats:", h2h.cache_stats())
+
+    if args.profile_json is not None:
+        print(f"Writing profiling data to {args.profile_json}...")
+        with args.profile_json.open("w") as f:
+            json.dump(profile, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if args.watch:
+        watch(args, h2h, mode, prelude, manifest)
 
     print("Done.")
 
 
+def make_translator(args, mode):
+    if not args.no_tags and (tags_file := args.in_dir / "tags").is_file():
+        print("Processing tags file...")
+        h2h = VimH2H(
+            mode=mode,
+            project=args.project,
+            tags=tags_file.read_text(),
+            engine=args.engine,
+            compact=args.compact,
+            static_path=export_static_path if args.export else None,
+            profile=args.profile_json is not None,
+        )
+        faq = args.in_dir / "vim_faq.txt"
+        if faq.is_file():
+            print("Processing FAQ tags...")
+            h2h.add_tags(faq.name, faq.read_text())
+    else:
+        print("Initializing tags...")
+        h2h = VimH2H(
+            mode=mode,
+            project=args.project,
+            engine=args.engine,
+            compact=args.compact,
+            static_path=export_static_path if args.export else None,
+            profile=args.profile_json is not None,
+        )
+        for infile in args.in_dir.iterdir():
+            if infile.suffix == ".txt":
+                h2h.add_tags(infile.name, infile.read_text())
+    return h2h
+
+
+def translate_file(h2h, infile, out_dir, prelude, compress=False):
+    """
+    Translate 'infile', writing the result to 'out_dir' unless that is None, along
+    with its precompressed siblings if 'compress' is true. Return the file name, the
+    number of bytes that compact mode saved on it (None if not in compact mode) and
+    the profiling data for it (None if not profiling).
+    """
+    content = infile.read_text()
+    # Written in one go, so that lines from parallel workers do not get mixed up
+    sys.stdout.write(f"Processing {infile}...\n")
+    sys.stdout.flush()
+    before = h2h.profile_stats()
+    chunks = h2h.iter_html(infile.name, content)
+    if out_dir is not None:
+        outfile = out_dir / f"{infile.name}.html"
+        write_streamed_output(outfile, itertools.chain((prelude,), chunks), compress)
+    else:
+        for _ in chunks:
+            pass
+    saved = h2h.compact_savings().get(infile.name)
+    file_profile = None
+    if before is not None:
+        file_profile = profile_delta(h2h.profile_stats(), before)
+    return infile.name, saved, file_profile
+
+
+# The translator used by 'translate_parallel' workers, which inherit it from the parent
+# process when they are forked, rather than have it pickled
+_worker_h2h = None
+
+
+def translate_parallel(h2h, infiles, out_dir, prelude, compress, jobs):
+    """
+    Generator that translates 'infiles' with 'translate_file' in a pool of 'jobs'
+    worker processes, and yields the results in the order they complete.
+    """
+    global _worker_h2h
+    _worker_h2h = h2h
+    # Keep the garbage collector from touching (and thus copying) the pages that hold
+    # the tag table in the workers
+    gc.freeze()
+    try:
+        ctx = multiprocessing.get_context("fork")
+        with ctx.Pool(jobs) as pool:
+            tasks = ((infile, out_dir, prelude, compress) for infile in infiles)
+            yield from pool.imap_unordered(_translate_in_worker, tasks)
+    finally:
+        gc.unfreeze()
+        _worker_h2h = None
+
+
+def _translate_in_worker(task):
+    return translate_file(_worker_h2h, *task)
+
+
+def watch(args, h2h, mode, prelude, manifest):
+    """
+    Poll the input directory for changes until interrupted. When files change, update
+    the tags they define in the translator's tag table, and retranslate them along
+    with the files that may refer to a tag whose definition changed.
+    """
+    stamps = scan_dir(args.in_dir)
+    contents = {name: (args.in_dir / name).read_text() for name in stamps}
+    print(f"Watching {args.in_dir} for changes (press Ctrl-C to stop)...")
+    try:
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            new_stamps = scan_dir(args.in_dir)
+            changed = [n for n, stamp in new_stamps.items() if stamps.get(n) != stamp]
+            removed = [n for n in stamps if n not in new_stamps]
+            stamps = new_stamps
+            if len(changed) > 0 or len(removed) > 0:
+                h2h = rebuild(
+                    args, h2h, mode, prelude, manifest, contents, changed, removed
+                )
+    except KeyboardInterrupt:
+        pass
+
+
+def scan_dir(in_dir):
+    """
+    Return a dict mapping the name of each file in 'in_dir' that h2h.py translates to
+    its modification time and size.
+    """
+    stamps = {}
+    for entry in os.scandir(in_dir):
+        if (entry.name.endswith(".txt") or entry.name == "tags") and entry.is_file():
+            st = entry.stat()
+            stamps[entry.name] = st.st_mtime_ns, st.st_size
+    return stamps
+
+
+def rebuild(args, h2h, mode, prelude, manifest, contents, changed, removed):
+    """
+    Bring the output up to date after the files 'changed' and 'removed' (lists of
+    names) changed or disappeared. 'contents' maps the name of each input file to its
+    contents as of the last call, and is updated. Return the translator to use from
+    now on, which is 'h2h' unless it had to be made anew.
+    """
+    start = time.perf_counter()
+    updated = []
+    for name in changed:
+        content = (args.in_dir / name).read_text()
+        if contents.get(name) != content:
+            contents[name] = content
+            updated.append(name)
+    for name in removed:
+        del contents[name]
+        print(f"Removing {name}.html, whose input file is gone")
+        remove_output(args.out_dir / f"{name}.html")
+        manifest["files"].pop(f"{name}.html", None)
+    if len(updated) == 0 and len(removed) == 0:
+        return h2h
+
+    # Find the tags whose definitions changed, updating the tag table
+    changed_tags = set()
+    if not args.no_tags and "tags" in updated + removed:
+        # The tags file is read as a whole, so start over with a new translator
+        old_links = dict(h2h.sorted_tag_href_pairs())
+        h2h = make_translator(args, mode)
+        new_links = dict(h2h.sorted_tag_href_pairs())
+        changed_tags = {
+            tag
+            for tag in old_links.keys() | new_links.keys()
+            if old_links.get(tag) != new_links.get(tag)
+        }
+    else:
+        uses_tags_file = not args.no_tags and "tags" in contents
+
+        def is_tag_source(name):
+            return name == "vim_faq.txt" or (
+                not uses_tags_file and name.endswith(".txt")
+            )
+
+        tag_sources = {name for name in contents if is_tag_source(name)}
+        for name in updated + removed:
+            if not is_tag_source(name):
+                continue
+            old_tags = set(h2h.file_tags(name))
+            new_tags = set()
+            if name in contents:
+                new_tags = set(VimH2H.extract_tags(contents[name]))
+            h2h.remove_tag_list(name, old_tags - new_tags)
+            h2h.add_tag_list(name, new_tags - old_tags)
+            changed_tags |= old_tags ^ new_tags
+            # A tag that is no longer defined here may still be defined elsewhere
+            for tag in old_tags - new_tags:
+                for other in tag_sources - {name}:
+                    text = contents.get(other, "")
+                    if f"*{tag}*" in text and tag in VimH2H.extract_tags(text):
+                        h2h.add_tag_list(other, [tag])
+                        break
+
+    to_translate = {name for name in updated if name in contents}
+    to_translate.update(
+        name
+        for name, text in contents.items()
+        if any(tag in text for tag in changed_tags)
+    )
+    if len(args.basenames) != 0:
+        to_translate.intersection_update(args.basenames)
+    for name in sorted(to_translate):
+        infile = args.in_dir / name
+        translate_file(h2h, infile, args.out_dir, prelude, args.export)
+        source_hash = hashlib.sha256(infile.read_bytes()).hexdigest()
+        manifest["files"][f"{name}.html"] = source_hash
+    # The files not retranslated are up to date with the new build inputs too
+    manifest["inputs"] = build_inputs(args, mode, h2h, prelude)
+    save_manifest(args.out_dir, manifest)
+    if args.export:
+        # As after a full export: pages may have been added or removed, and their
+        # precompressed siblings may have changed
+        write_export_manifest(args.out_dir)
+    secs = time.perf_counter() - start
+    print(f"Updated {len(to_translate)} file(s) in {secs:.2f}s")
+    return h2h
+
+
+def build_inputs(args, mode, h2h, prelude):
+    """
+    Return a dict describing everything apart from its own input file that an output
+    file depends on: the options, hashes of the tags, the prelude, the templates and
+    the translator's code, and with --export, the fingerprinted asset names.
+    """
+    # Hashed in sorted order, since the order of the tag table changes with --watch
+    tags = hashlib.sha256()
+    for tag, href in h2h.sorted_tag_href_pairs():
+        tags.update(f"{tag}\0{href}\0".encode())
+    templates = hashlib.sha256()
+    for path in sorted((root_path / "vimhelp" / "templates").iterdir()):
+        templates.update(f"{path.name}\0{path.stat().st_size}\0".encode())
+        templates.update(path.read_bytes())
+    code = (root_path / "vimhelp" / "vimh2h.py").read_bytes()
+    return {
+        "options": f"{mode}:{args.project}:{'compact' if args.compact else ''}",
+        "tags": tags.hexdigest(),
+        "prelude": hashlib.sha256(prelude).hexdigest(),
+        "templates": templates.hexdigest(),
+        "code": hashlib.sha256(code).hexdigest(),
+        "static_paths": dict(_export_asset_names),
+    }
+
+
+def load_manifest(out_dir, inputs, force):
+    """
+    Return the build manifest of 'out_dir', a dict holding the given build 'inputs'
+    and, in "files", the hash of the input file of each output file that is up to
+    date. If the manifest is missing, or was made with different build inputs (or
+    'force' is true), no output file counts as up to date.
+    """
+    manifest = {"version": MANIFEST_VERSION, "inputs": inputs, "files": {}}
+    path = out_dir / MANIFEST_NAME
+    if force or not path.exists():
+        return manifest
+    try:
+        old_manifest = json.loads(path.read_text())
+    except ValueError:
+        print(f"Ignoring invalid build manifest {path}")
+        return manifest
+    if (
+        old_manifest.get("version") == MANIFEST_VERSION
+        and old_manifest.get("inputs") == inputs
+    ):
+        manifest["files"] = old_manifest["files"]
+    return manifest
+
+
+def save_manifest(out_dir, manifest):
+    # Replace the manifest atomically, so that it never claims more than is true
+    path = out_dir / MANIFEST_NAME
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=2, sort_keys=True) + "\n")
+    tmp_path.replace(path)
+
+
+def remove_stale_outputs(out_dir, manifest, in_dir):
+    """Remove the output files whose input files no longer exist."""
+    for name in list(manifest["files"]):
+        if not (in_dir / name.removesuffix(".html")).exists():
+            print(f"Removing {name}, whose input file is gone")
+            remove_output(out_dir / name)
+            del manifest["files"][name]
+
+
+def write_if_changed(path, data):
+    """
+    Write 'data' to 'path', unless it already holds exactly that, so that unchanged
+    files keep their modification times (which matters for rsync and the like).
+    Return whether it was written.
+    """
+    try:
+        if path.stat().st_size == len(data) and path.read_bytes() == data:
+            return False
+    except FileNotFoundError:
+        pass
+    path.write_bytes(data)
+    return True
+
+
+def write_output(path, data, compress):
+    """
+    Write 'data' to 'path' like 'write_if_changed', and if 'compress' is true, also
+    write its precompressed siblings (where compression makes it smaller).
+    """
+    is_changed = write_if_changed(path, data)
+    if compress:
+        write_siblings(path, is_changed)
+
+
+def write_streamed_output(path, chunks, compress):
+    """
+    Like 'write_output', but for data given as an iterable of byte strings, which is
+    never held in memory as a whole: the chunks are written to a temporary file next
+    to 'path' and hashed along the way, and the temporary file then replaces 'path'
+    unless that already holds the same data.
+    """
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    hash_ = hashlib.sha256()
+    try:
+        with tmp_path.open("wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                hash_.update(chunk)
+            size = f.tell()
+        is_changed = file_hash(path, size) != hash_.digest()
+        if is_changed:
+            tmp_path.replace(path)
+        else:
+            tmp_path.unlink()
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    if compress:
+        write_siblings(path, is_changed)
+
+
+def file_hash(path, size):
+    """
+    Return the SHA-256 digest of the file at 'path', or None if it does not exist or
+    its size is not 'size' (in which case it cannot hold the data being compared).
+    """
+    try:
+        with path.open("rb") as f:
+            if os.fstat(f.fileno()).st_size != size:
+                return None
+            return hashlib.file_digest(f, "sha256").digest()
+    except FileNotFoundError:
+        return None
+
+
+def write_siblings(path, is_changed):
+    """
+    Write the precompressed siblings of the file at 'path' (where compression makes
+    it smaller), compressing it a block at a time. If the file is unchanged (as
+    'is_changed' says), existing siblings are kept.
+    """
+    size = path.stat().st_size
+    for _, suffix, make_compressor in COMPRESSIONS:
+        sibling = path.with_name(path.name + suffix)
+        if not is_changed and sibling.exists():
+            continue
+        tmp_path = sibling.with_name(f"{sibling.name}.tmp")
+        compressor = make_compressor()
+        try:
+            with path.open("rb") as src, tmp_path.open("wb") as dst:
+                while block := src.read(BLOCK_SIZE):
+                    dst.write(compressor.compress(block))
+                dst.write(compressor.flush())
+                compressed_size = dst.tell()
+            if compressed_size < size:
+                tmp_path.replace(sibling)
+            else:
+                tmp_path.unlink()
+                sibling.unlink(missing_ok=True)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+
+def remove_output(path):
+    """Remove output file 'path' and any precompressed siblings of it."""
+    path.unlink(missing_ok=True)
+    for suffix in SIBLING_SUFFIXES:
+        path.with_name(path.name + suffix).unlink(missing_ok=True)
+
+
+def export_static_path(name):
+    return _export_asset_names[name]
+
+
+def export_assets(out_dir, mode):
+    """
+    Write the static assets and the rendered vimhelp.css and vimhelp.js to 'out_dir'
+    for --export, with their content hashes in their names (as 'assets.init' does
+    for the web app, so that they can be cached indefinitely), and remember the names
+    for 'export_static_path'.
+    """
+    static_dir = root_path / "vimhelp" / "static"
+    contents = {path.name: path.read_bytes() for path in sorted(static_dir.iterdir())}
+    for name, content in contents.items():
+        _export_asset_names[name] = fingerprinted_name(name, content)
+    # These refer to the assets above, so are rendered once their names are known
+    for name in "vimhelp.css", "vimhelp.js":
+        content = render_template(name, static_path=export_static_path, mode=mode)
+        contents[name] = content.encode()
+        _export_asset_names[name] = fingerprinted_name(name, contents[name])
+    for name, content in contents.items():
+        write_output(out_dir / _export_asset_names[name], content, compress=True)
+    if brotli is None:
+        print("Note: brotli module not available, not writing .br files")
+    if zstd is None:
+        print("Note: compression.zstd module not available, not writing .zst files")
+
+
+def write_bundle(path, out_dir, h2h, mode, project):
+    """
+    Pack the files in 'out_dir' (apart from manifests and precompressed siblings)
+    and the tags of translator 'h2h' into a new SQLite database at 'path', which
+    replaces any existing one once complete.
+    """
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.unlink(missing_ok=True)
+    con = sqlite3.connect(tmp_path)
+    try:
+        with con:
+            con.executescript(BUNDLE_SCHEMA)
+            for outfile in sorted(out_dir.iterdir()):
+                name = outfile.name
+                if (
+                    name in (MANIFEST_NAME, EXPORT_MANIFEST_NAME)
+                    or outfile.suffix in SIBLING_SUFFIXES
+                    or not outfile.is_file()
+                ):
+                    continue
+                data = outfile.read_bytes()
+                encoding = None
+                compressed = gzip.compress(data, compresslevel=9, mtime=0)
+                if len(compressed) < len(data):
+                    data = compressed
+                    encoding = "gzip"
+                content_type = mimetypes.guess_type(name)[0]
+                con.execute(
+                    "INSERT INTO files VALUES (?, ?, ?, ?)",
+                    (name, content_type or "application/octet-stream", encoding, data),
+                )
+            con.executemany(
+                "INSERT INTO tags VALUES (?, ?)", h2h.sorted_tag_href_pairs()
+            )
+            meta = {
+                "version": str(BUNDLE_VERSION),
+                "project": project,
+                "mode": mode,
+                "index": "help.txt.html",
+            }
+            con.executemany("INSERT INTO meta VALUES (?, ?)", meta.items())
+        con.execute("VACUUM")
+    finally:
+        con.close()
+    tmp_path.replace(path)
+
+
+def fingerprinted_name(name, content):
+    # Same hash as 'assets._add_curr_asset'
+    hash_ = base64.urlsafe_b64encode(hashlib.sha256(content).digest()[:12]).decode()
+    stem, dot, suffix = name.partition(".")
+    return f"{stem}.{hash_}{dot}{suffix}"
+
+
+def write_export_manifest(out_dir):
+    """
+    Write the manifest of an --export: for each file to serve, its content type,
+    cache control header and the content encodings that it has precompressed
+    siblings for. Fingerprinted assets from earlier exports that are no longer used
+    are removed.
+    """
+    path = out_dir / EXPORT_MANIFEST_NAME
+    asset_names = set(_export_asset_names.values())
+    if path.exists():
+        for name in json.loads(path.read_text())["files"]:
+            if not name.endswith(".html") and name not in asset_names:
+                print(f"Removing {name}, which is no longer used")
+                remove_output(out_dir / name)
+
+    files = {}
+    names = sorted(p.name for p in out_dir.glob("*.html"))
+    for name in names + sorted(asset_names):
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if content_type.startswith("text/") or content_type.endswith("javascript"):
+            content_type += "; charset=utf-8"
+        files[name] = {
+            "content_type": content_type,
+            "cache_control": (
+                PAGE_CACHE_CONTROL if name.endswith(".html") else ASSET_CACHE_CONTROL
+            ),
+            "encodings": [
+                encoding
+                for encoding, suffix, _ in COMPRESSIONS
+                if (out_dir / f"{name}{suffix}").exists()
+            ],
+        }
+    manifest = {"index": "help.txt.html", "files": files}
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=2, sort_keys=True) + "\n")
+    tmp_path.replace(path)
+
+
+def profile_delta(after, before):
+    """Return the difference between two profiling data dicts, entry by entry."""
+    if isinstance(after, dict):
+        before = before or {}
+        return {key: profile_delta(after[key], before.get(key)) for key in after}
+    return after - (before or 0)
+
+
+def add_profile(total, delta):
+    """Add profiling data dict 'delta' to 'total', entry by entry."""
+    for key, value in delta.items():
+        if isinstance(value, dict):
+            add_profile(total.setdefault(key, {}), value)
+        else:
+            total[key] = total.get(key, 0) + value
+
+
 main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env .venv/bin/python3
+
+# Translates whole Vim and/or Neovim doc trees with every translator engine and checks
+# that they all produce byte-identical HTML, both from 'to_html' and 'iter_html'. Meant
+# to be run from the top-level directory of the repository, as
+# 'scripts/h2h_compare.py', like 'scripts/h2h.py'.
+
+import argparse
+import pathlib
+import sys
+import time
+
+root_path = pathlib.Path(__file__).parent.parent
+
+sys.path.append(str(root_path))
+
+from vimhelp.vimh2h import ENGINES, VimH2H  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that all translator engines produce identical HTML"
+    )
+    parser.add_argument(
+        "--vim-dir", type=pathlib.Path, help="Directory of Vim doc files"
+    )
+    parser.add_argument(
+        "--neovim-dir", type=pathlib.Path, help="Directory of Neovim doc files"
+    )
+    parser.add_argument(
+        "--mode",
+        choices=("online", "hybrid", "offline"),
+        action="append",
+        help="Translation mode(s) to check (default: all)",
+    )
+    parser.add_argument(
+        "--compact", action="store_true", help="Check compact HTML output"
+    )
+    args = parser.parse_args()
+
+    trees = [
+        (project, in_dir)
+        for project, in_dir in (("vim", args.vim_dir), ("neovim", args.neovim_dir))
+        if in_dir is not None
+    ]
+    if len(trees) == 0:
+        parser.error("at least one of --vim-dir and --neovim-dir is required")
+
+    num_failures = 0
+    for project, in_dir in trees:
+        for mode in args.mode or ("online", "hybrid", "offline"):
+            num_failures += compare(project, in_dir, mode, args.compact)
+
+    if num_failures > 0:
+        sys.exit(f"{num_failures} file(s) differ")
+    print("All engines agree.")
+
+
+def compare(project, in_dir, mode, compact):
+    if not in_dir.is_dir():
+        raise RuntimeError(f"{in_dir} is not a directory")
+
+    files = sorted(
+        p for p in in_dir.iterdir() if p.suffix == ".txt" or p.name == "tags"
+    )
+    contents = {p.name: p.read_text() for p in files}
+
+    translators = {
+        engine: make_h2h(project, mode, engine, compact, contents) for engine in ENGINES
+    }
+
+    print(f"Comparing {len(files)} {project} files in {mode} mode...")
+    num_failures = 0
+    timings = dict.fromkeys(ENGINES, 0.0)
+    for name, content in contents.items():
+        outputs = {}
+        for engine, h2h in translators.items():
+            start = time.perf_counter()
+            outputs[engine] = h2h.to_html(name, content).encode()
+            timings[engine] += time.perf_counter() - start
+        ref_engine, *other_engines = ENGINES
+        ref = outputs[ref_engine]
+        for engine in other_engines:
+            if outputs[engine] != ref:
+                num_failures += 1
+                print(f"  {name}: {engine} differs from {ref_engine}")
+                print_first_difference(ref, outputs[engine])
+        for engine, h2h in translators.items():
+            streamed = b"".join(h2h.iter_html(name, content))
+            if streamed != outputs[engine]:
+                num_failures += 1
+                print(f"  {name}: {engine} iter_html differs from to_html")
+                print_first_difference(outputs[engine], streamed)
+
+    for engine, secs in timings.items():
+        print(f"  {engine}: {secs:.3f}s")
+    return num_failures
+
+
+def make_h2h(project, mode, engine, compact, contents):
+    if project == "vim" and "tags" in contents:
+        h2h = VimH2H(
+            mode=mode,
+            project=project,
+            tags=contents["tags"],
+            engine=engine,
+            compact=compact,
+        )
+        if (faq := contents.get("vim_faq.txt")) is not None:
+            h2h.add_tags("vim_faq.txt", faq)
+    else:
+        h2h = VimH2H(mode=mode, project=project, engine=engine, compact=compact)
+        for name, content in contents.items():
+            if name != "tags":
+                h2h.add_tags(name, content)
+    return h2h
+
+
+def print_first_difference(a, b):
+    a_lines = a.splitlines()
+    b_lines = b.splitlines()
+    for lineno, (a_line, b_line) in enumerate(zip(a_lines, b_lines, strict=False), 1):
+        if a_line != b_line:
+            print(f"    line {lineno}:")
+            print(f"      - {a_line!r}")
+            print(f"      + {b_line!r}")
+            return
+    print(f"    line counts differ: {len(a_lines)} vs {len(b_lines)}")
+
+
+main()
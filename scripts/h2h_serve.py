@@ -0,0 +1,136 @@
+#!/usr/bin/env .venv/bin/python3
+
+# Serves the pages in a bundle made by 'scripts/h2h.py --bundle' over HTTP, reading
+# each file straight from the bundle. Besides the files themselves, '/tag/<tag>'
+# redirects to the page and anchor of a tag. Meant to be run from the top-level
+# directory of the repository, as 'scripts/h2h_serve.py', like 'scripts/h2h.py'.
+
+import argparse
+import contextlib
+import gzip
+import http
+import http.server
+import pathlib
+import sqlite3
+import sys
+import threading
+import urllib.parse
+
+root_path = pathlib.Path(__file__).parent.parent
+
+sys.path.append(str(root_path))
+
+from vimhelp.bundle import BUNDLE_VERSION  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a bundle made by h2h.py")
+    parser.add_argument("bundle", type=pathlib.Path, help="Bundle file")
+    parser.add_argument(
+        "--port", "-p", type=int, default=8000, help="Port to listen on (default: 8000)"
+    )
+    parser.add_argument(
+        "--bind",
+        "-b",
+        default="127.0.0.1",
+        help="Address to listen on (default: 127.0.0.1)",
+    )
+    args = parser.parse_args()
+
+    bundle = Bundle(args.bundle)
+    meta = bundle.meta()
+    if meta.get("version") != str(BUNDLE_VERSION):
+        sys.exit(f"{args.bundle} is not a bundle of version {BUNDLE_VERSION}")
+
+    handler = type("BoundRequestHandler", (RequestHandler,), {"bundle": bundle})
+    server = http.server.ThreadingHTTPServer((args.bind, args.port), handler)
+    url = f"http://{args.bind}:{args.port}/"
+    print(f"Serving {meta['project']} help from {args.bundle} at {url}")
+    with contextlib.suppress(KeyboardInterrupt):
+        server.serve_forever()
+
+
+class Bundle:
+    """
+    Read-only access to a bundle. Each thread gets its own database connection, as
+    SQLite connections cannot be shared between threads.
+    """
+
+    def __init__(self, path):
+        if not path.is_file():
+            sys.exit(f"{path} does not exist")
+        self._uri = f"{path.resolve().as_uri()}?mode=ro"
+        self._local = threading.local()
+
+    def meta(self):
+        return dict(self._con().execute("SELECT key, value FROM meta"))
+
+    def file(self, name):
+        """Return '(content_type, encoding, data)' for file 'name', or None."""
+        query = "SELECT content_type, encoding, data FROM files WHERE name = ?"
+        return self._con().execute(query, (name,)).fetchone()
+
+    def tag_href(self, tag):
+        query = "SELECT href FROM tags WHERE tag = ?"
+        row = self._con().execute(query, (tag,)).fetchone()
+        return None if row is None else row[0]
+
+    def _con(self):
+        if (con := getattr(self._local, "con", None)) is None:
+            con = self._local.con = sqlite3.connect(self._uri, uri=True)
+        return con
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    bundle = None  # set in a subclass by 'main'
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        # The same headers as for GET, including the length of the body it would get
+        self._serve(send_body=False)
+
+    def _serve(self, send_body):
+        path = urllib.parse.urlsplit(self.path).path
+        if path.startswith("/tag/"):
+            tag = urllib.parse.unquote(path.removeprefix("/tag/"))
+            if (href := self.bundle.tag_href(tag)) is None:
+                self.send_error(http.HTTPStatus.NOT_FOUND, f"No such tag: {tag}")
+                return
+            self.send_response(http.HTTPStatus.FOUND)
+            self.send_header("Location", f"/{href}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        name = urllib.parse.unquote(path.removeprefix("/"))
+        if name == "":
+            name = self.bundle.meta()["index"]
+        if (row := self.bundle.file(name)) is None:
+            self.send_error(http.HTTPStatus.NOT_FOUND)
+            return
+        content_type, encoding, data = row
+        if encoding == "gzip" and not self._accepts_gzip():
+            data = gzip.decompress(data)
+            encoding = None
+        self.send_response(http.HTTPStatus.OK)
+        if content_type.startswith("text/") or content_type.endswith("javascript"):
+            content_type += "; charset=utf-8"
+        self.send_header("Content-Type", content_type)
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+
+    def _accepts_gzip(self):
+        accept = self.headers.get("Accept-Encoding", "")
+        return any(
+            coding.split(";")[0].strip() == "gzip" for coding in accept.split(",")
+        )
+
+
+main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env .venv/bin/python3
+
+# Reports how much memory the translator's tag table takes, per tag, and how much the
+# representation it replaced (a dict of one 'Link' object per tag) takes for the same
+# tags, as a baseline. Meant to be run from the top-level directory of the repository,
+# as 'scripts/tags_memory.py', like 'scripts/h2h.py'.
+
+import argparse
+import gc
+import html
+import pathlib
+import sys
+import tracemalloc
+import urllib.parse
+
+root_path = pathlib.Path(__file__).parent.parent
+
+sys.path.append(str(root_path))
+
+from vimhelp.vimh2h import RE_LINKWORD, RE_NEWLINE, RE_TAGLINE, VimH2H  # noqa: E402
+
+
+class BaselineLink:
+    # What the translator kept per tag before 'vimh2h.TagTable' (without the entries of
+    # the caches of its 'href' and 'html' methods, which only filled up as it went)
+    def __init__(self, filename, htmlfilename, tag):
+        self.filename = filename
+        self._htmlfilename = htmlfilename
+        if tag == "help-tags" and filename == "tags":
+            self._tag_quoted = None
+        else:
+            self._tag_quoted = urllib.parse.quote_plus(tag)
+        self._tag_escaped = html.escape(tag, quote=False)
+        self._cssclass = "d"
+        if m := RE_LINKWORD.match(tag):
+            self._cssclass = "oks"[m.lastindex - 1]
+
+
+def baseline_init(tags):
+    # Like 'VimH2H.__init__' before 'vimh2h.TagTable': a translator without tags, and
+    # a dict mapping each tag to its 'BaselineLink'
+    h2h = VimH2H(mode="online", project="vim")
+    urls = {}
+    for line in RE_NEWLINE.split(tags):
+        if m := RE_TAGLINE.match(line):
+            tag, filename = m.group(1, 2)
+            urls[tag] = BaselineLink(filename, h2h.htmlfilename(filename), tag)
+    urls["help-tags"] = BaselineLink("tags", "tags.html", "help-tags")
+    return h2h, urls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report tag table memory usage")
+    parser.add_argument(
+        "--in-dir",
+        "-i",
+        required=True,
+        type=pathlib.Path,
+        help="Directory of Vim doc files (must contain a tags file)",
+    )
+    args = parser.parse_args()
+
+    tags = (args.in_dir / "tags").read_text()
+    num_tags = sum(1 for line in tags.splitlines() if line.strip())
+    contents = {p.name: p.read_text() for p in sorted(args.in_dir.glob("*.txt"))}
+
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    baseline = baseline_init(tags)
+    gc.collect()
+    baseline_init_size = tracemalloc.get_traced_memory()[0] - base
+    del baseline
+    gc.collect()
+    base = tracemalloc.get_traced_memory()[0]
+    h2h = VimH2H(mode="online", project="vim", tags=tags)
+    gc.collect()
+    after_init = tracemalloc.get_traced_memory()[0] - base
+    for name, content in contents.items():
+        for _ in h2h.iter_html(name, content):
+            pass
+    gc.collect()
+    after_translate = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+
+    print(f"{num_tags} tags")
+    print(
+        f"baseline __init__:   {baseline_init_size:>10} bytes, "
+        f"{baseline_init_size / num_tags:7.1f} bytes/tag"
+    )
+    print(
+        f"after __init__:      {after_init:>10} bytes, "
+        f"{after_init / num_tags:7.1f} bytes/tag"
+    )
+    print(
+        f"after translating:   {after_translate:>10} bytes, "
+        f"{after_translate / num_tags:7.1f} bytes/tag"
+    )
+
+
+main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env .venv/bin/python3
+
+# Builds the compression dictionary that pages are compressed against for the "dcz"
+# content encoding (see 'vimhelp/dcz.py'), from the pages that the Vim and/or Neovim doc
+# trees translate to. The dictionary is a "raw content" one, i.e. just a sequence of
+# bytes that the compressor can refer back to: it is made of the pieces of markup and
+# text that the most pages have in common, the most common ones last, where they are the
+# cheapest to refer to. Meant to be run from the top-level directory of the repository,
+# as 'scripts/train_dict.py', like 'scripts/h2h.py'; rerun it after changes that affect
+# much of the markup of pages, and commit the result.
+
+import argparse
+import collections
+import pathlib
+import re
+import sys
+
+root_path = pathlib.Path(__file__).parent.parent
+
+sys.path.append(str(root_path))
+
+from vimhelp.vimh2h import VimH2H  # noqa: E402
+
+DEFAULT_OUT = root_path / "vimhelp" / "vimhelp.dict"
+
+# Pieces are whole lines, and the HTML tags and runs of text within them
+RE_PIECE = re.compile(r"<[^>]*>|[^<\n]+")
+
+# Pieces shorter than this are cheaper to encode literally than to refer to
+MIN_PIECE_LEN = 8
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the compression dictionary")
+    parser.add_argument(
+        "--vim-dir", type=pathlib.Path, help="Directory of Vim doc files"
+    )
+    parser.add_argument(
+        "--neovim-dir", type=pathlib.Path, help="Directory of Neovim doc files"
+    )
+    parser.add_argument(
+        "--size",
+        "-s",
+        type=int,
+        default=65536,
+        help="Dictionary size in bytes (default: 65536)",
+    )
+    parser.add_argument(
+        "--out",
+        "-o",
+        type=pathlib.Path,
+        default=DEFAULT_OUT,
+        help=f"Output file (default: {DEFAULT_OUT.relative_to(root_path)})",
+    )
+    args = parser.parse_args()
+
+    trees = [
+        (project, in_dir)
+        for project, in_dir in (("vim", args.vim_dir), ("neovim", args.neovim_dir))
+        if in_dir is not None
+    ]
+    if len(trees) == 0:
+        parser.error("at least one of --vim-dir and --neovim-dir is required")
+
+    doc_freqs = collections.Counter()
+    num_pages = 0
+    for project, in_dir in trees:
+        print(f"Translating {project} files in {in_dir}...")
+        for page in translate_tree(project, in_dir):
+            doc_freqs.update(page_pieces(page))
+            num_pages += 1
+
+    content = build_dict(doc_freqs, args.size)
+    args.out.write_bytes(content)
+    print(f"Wrote {len(content)}-byte dictionary from {num_pages} pages to {args.out}")
+
+
+def translate_tree(project, in_dir):
+    if not in_dir.is_dir():
+        raise RuntimeError(f"{in_dir} is not a directory")
+    files = sorted(
+        p for p in in_dir.iterdir() if p.suffix == ".txt" or p.name == "tags"
+    )
+    contents = {p.name: p.read_text() for p in files}
+    if project == "vim" and "tags" in contents:
+        h2h = VimH2H(mode="online", project=project, tags=contents["tags"])
+        if (faq := contents.get("vim_faq.txt")) is not None:
+            h2h.add_tags("vim_faq.txt", faq)
+    else:
+        h2h = VimH2H(mode="online", project=project)
+        for name, content in contents.items():
+            if name != "tags":
+                h2h.add_tags(name, content)
+    for name, content in contents.items():
+        yield h2h.to_html(name, content)
+
+
+def page_pieces(page):
+    """Return the set of pieces of 'page' that are worth having in the dictionary."""
+    pieces = set()
+    for line in page.splitlines():
+        if len(line) >= MIN_PIECE_LEN:
+            pieces.add(line + "\n")
+            pieces.update(p for p in RE_PIECE.findall(line) if len(p) >= MIN_PIECE_LEN)
+    return pieces
+
+
+def build_dict(doc_freqs, size):
+    """
+    Return the dictionary content: the pieces that save the most bytes across all pages
+    (by the number of pages that contain them, times their length) that fit in 'size'
+    bytes, least valuable first. Pieces that pages only share by chance are left out,
+    as are pieces contained in ones that are already in.
+    """
+    candidates = sorted(
+        (
+            (count * len(piece.encode()), piece)
+            for piece, count in doc_freqs.items()
+            if count >= 2
+        ),
+        reverse=True,
+    )
+    chosen = []
+    chosen_text = ""
+    num_bytes = 0
+    for _, piece in candidates:
+        if num_bytes > size - MIN_PIECE_LEN:
+            break
+        piece_len = len(piece.encode())
+        if num_bytes + piece_len > size or piece in chosen_text:
+            continue
+        chosen.append(piece)
+        chosen_text += piece
+        num_bytes += piece_len
+    return "".join(reversed(chosen)).encode()
+
+
+main()
@@ -15,7 +15,9 @@ import google.cloud.tasks
 import werkzeug.exceptions
 
 from . import dbmodel
+from . import dcz
 from . import secret
+from . import vimh2h
 
 
 _DELETE_GRACE_PERIOD = datetime.timedelta(days=1)
@@ -26,14 +28,15 @@ _assets_written_lock = threading.Lock()
 _assets_written = False
 
 
-def init(app):
+def init():
     for asset in _asset_resources().iterdir():
         _add_curr_asset(asset.name, asset.read_bytes())
 
-    with app.app_context():
-        for name in "vimhelp.css", "vimhelp.js":
-            content = flask.render_template(name, mode="online").encode()
-            _add_curr_asset(name, content)
+    for name in "vimhelp.css", "vimhelp.js":
+        content = vimh2h.render_template(name, static_path=static_path, mode="online")
+        _add_curr_asset(name, content.encode())
+
+    _add_curr_asset(dcz.DICT_NAME, dcz.dict_content())
 
 
 def handle_static(name, hash_, immutable=True):
@@ -41,8 +44,12 @@ def handle_static(name, hash_, immutable=True):
         hash_ = _curr_asset_hash(name)
     if asset := _get_asset(name, hash_):
         mimetype, _ = mimetypes.guess_type(name)
+        if mimetype is None:
+            mimetype = "application/octet-stream"
         logging.info("Serving static asset %s/%s (%s)", hash_, name, mimetype)
         resp = flask.Response(asset, mimetype=mimetype)
+        if name == dcz.DICT_NAME:
+            resp.headers["Use-As-Dictionary"] = dcz.USE_AS_DICTIONARY
         if immutable:
             resp.cache_control.immutable = True
             resp.cache_control.max_age = 3600 * 24 * 365
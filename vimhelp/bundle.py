@@ -0,0 +1,20 @@
+# Format of the bundles that 'scripts/h2h.py --bundle' makes and 'scripts/h2h_serve.py'
+# serves
+
+# Schema of a bundle, which is a SQLite database: the output files (gzip-compressed
+# where that makes them smaller), the tags with the URLs they link to, and information
+# about the build
+BUNDLE_SCHEMA = """
+CREATE TABLE files (
+    name TEXT PRIMARY KEY,
+    content_type TEXT NOT NULL,
+    encoding TEXT,
+    data BLOB NOT NULL
+);
+CREATE TABLE tags (tag TEXT PRIMARY KEY, href TEXT NOT NULL) WITHOUT ROWID;
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID;
+"""
+
+# Recorded as "version" in the meta table; must be incremented whenever the schema or
+# the meaning of the data changes
+BUNDLE_VERSION = 1
@@ -1,3 +1,5 @@
+import array
+import collections
 import logging
 import threading
 
@@ -8,34 +10,76 @@ from .dbmodel import GlobalInfo, ndb_context
 
 _REFRESH_INTERVAL_SEC = 120
 
+# Default byte budget of each project's cache
+DEFAULT_BUDGET = 64 * 1024 * 1024
+
+# Share of the budget that goes to the window, which holds new entries until they have
+# to compete for a place in the main part of the cache
+_WINDOW_SHARE = 0.01
+
+# Share of the main part of the cache that goes to entries that were hit there
+_PROTECTED_SHARE = 0.8
+
 
 class Cache:
-    def __init__(self):
+    """
+    In-process cache of values by project and key, holding at most 'budget' bytes per
+    project; the size of each value is given when putting it. Eviction follows
+    W-TinyLFU: new values enter a small LRU "window", and values evicted from that are
+    only admitted into the main part of the cache (a segmented LRU) if they have been
+    requested more often lately than the values they would displace. This way, a burst
+    of one-off requests (e.g. a crawler walking the sitemap) cannot flush the values
+    that are requested all the time.
+
+    If 'disk' is given, it is a 'diskcache.DiskCache' (available as the 'disk'
+    attribute) that the refresh loop keeps validated; looking pages up in it is up to
+    the caller.
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET, disk=None):
+        self._budget = budget
+        self.disk = disk
         self._cache = {}
         self._lock = threading.Lock()
 
     def get(self, project, key):
         with self._lock:
-            return self._cache.get(project, {}).get(key)
+            return self._project_cache(project).get(key)
 
-    def put(self, project, key, value):
+    def put(self, project, key, value, size):
         with self._lock:
-            logging.info("writing %s:%s to inproc cache", project, key)
-            self._cache.setdefault(project, {})[key] = value
+            logging.info("writing %s:%s to inproc cache (%d bytes)", project, key, size)
+            self._project_cache(project).put(key, value, size)
 
     def clear(self, project):
         with self._lock:
             if c := self._cache.get(project):
                 c.clear()
 
+    def stats(self):
+        """Return a dict mapping each project to its cache's counters."""
+        with self._lock:
+            return {project: c.stats() for project, c in self._cache.items()}
+
     def start_refresh_loop(self, refresh_callback):
         update_times = Cache._get_update_times()
+        if self.disk is not None:
+            self.disk.validate(update_times)
         gevent.spawn_later(
             _REFRESH_INTERVAL_SEC, self._refresh, update_times, refresh_callback
         )
 
+    def _project_cache(self, project):
+        if (c := self._cache.get(project)) is None:
+            c = self._cache[project] = _ProjectCache(self._budget)
+        return c
+
     def _refresh(self, old_update_times, refresh_callback):
+        for project, stats in self.stats().items():
+            logging.info("inproc cache stats for %s: %s", project, stats)
         update_times = Cache._get_update_times()
+        if self.disk is not None:
+            self.disk.validate(update_times)
         for project, update_time in update_times.items():
             old_update_time = old_update_times.get(project)
             if old_update_time is None or update_time > old_update_time:
@@ -59,3 +103,148 @@ class Cache:
     def _get_update_times():
         with ndb_context():
             return {g.key.id(): g.last_update_time for g in GlobalInfo.query()}
+
+
+class _ProjectCache:
+    # The cache of one project. Each of the three segments is an 'OrderedDict' mapping
+    # keys to '(value, size)', least recently used first.
+
+    def __init__(self, budget):
+        self._budget = budget
+        self._window_budget = int(budget * _WINDOW_SHARE)
+        self._protected_budget = int((budget - self._window_budget) * _PROTECTED_SHARE)
+        self._window = collections.OrderedDict()
+        self._probation = collections.OrderedDict()
+        self._protected = collections.OrderedDict()
+        self._window_bytes = 0
+        self._probation_bytes = 0
+        self._protected_bytes = 0
+        self._sketch = _FrequencySketch()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._rejections = 0
+
+    def get(self, key):
+        self._sketch.increment(key)
+        if (entry := self._window.get(key)) is not None:
+            self._window.move_to_end(key)
+        elif (entry := self._protected.get(key)) is not None:
+            self._protected.move_to_end(key)
+        elif (entry := self._probation.pop(key, None)) is not None:
+            # Hit in probation: promote to protected, demoting the least recently used
+            # protected entries if that makes it too big
+            size = entry[1]
+            self._probation_bytes -= size
+            self._protected[key] = entry
+            self._protected_bytes += size
+            while self._protected_bytes > self._protected_budget:
+                demoted_key, demoted = self._protected.popitem(last=False)
+                self._protected_bytes -= demoted[1]
+                self._probation[demoted_key] = demoted
+                self._probation_bytes += demoted[1]
+        else:
+            self._misses += 1
+            return None
+        self._hits += 1
+        return entry[0]
+
+    def put(self, key, value, size):
+        self._remove(key)
+        if size > self._budget - self._window_budget:
+            self._rejections += 1
+            return
+        self._window[key] = value, size
+        self._window_bytes += size
+        while self._window_bytes > self._window_budget:
+            candidate_key, candidate = self._window.popitem(last=False)
+            self._window_bytes -= candidate[1]
+            self._admit(candidate_key, candidate)
+
+    def clear(self):
+        for segment in self._window, self._probation, self._protected:
+            segment.clear()
+        self._window_bytes = self._probation_bytes = self._protected_bytes = 0
+
+    def stats(self):
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+            "rejections": self._rejections,
+            "entries": len(self._window) + len(self._probation) + len(self._protected),
+            "bytes": self._window_bytes + self._probation_bytes + self._protected_bytes,
+            "budget": self._budget,
+        }
+
+    def _admit(self, key, entry):
+        # Admit 'entry' (evicted from the window) into probation if it fits, or if it
+        # has been requested more often than each of the entries that would need to
+        # be evicted to make it fit; otherwise, it is rejected.
+        main_budget = self._budget - self._window_budget
+        excess = self._probation_bytes + self._protected_bytes + entry[1] - main_budget
+        victims = []
+        if excess > 0:
+            freq = self._sketch.frequency(key)
+            for segment in self._probation, self._protected:
+                for victim_key, victim in segment.items():
+                    if excess <= 0:
+                        break
+                    if self._sketch.frequency(victim_key) >= freq:
+                        self._rejections += 1
+                        return
+                    victims.append((segment, victim_key))
+                    excess -= victim[1]
+        for segment, victim_key in victims:
+            self._remove_from(segment, victim_key)
+            self._evictions += 1
+        self._probation[key] = entry
+        self._probation_bytes += entry[1]
+
+    def _remove(self, key):
+        for segment in self._window, self._probation, self._protected:
+            if key in segment:
+                self._remove_from(segment, key)
+
+    def _remove_from(self, segment, key):
+        _, size = segment.pop(key)
+        if segment is self._window:
+            self._window_bytes -= size
+        elif segment is self._probation:
+            self._probation_bytes -= size
+        else:
+            self._protected_bytes -= size
+
+
+class _FrequencySketch:
+    # Count-min sketch of how often keys have been requested lately: each key has a
+    # small counter in each of a few rows, and its frequency is the minimum of them.
+    # Counters are halved every so often, so that old requests count for less.
+
+    _DEPTH = 4
+    _WIDTH = 4096
+    _MAX_COUNT = 15
+
+    def __init__(self):
+        self._rows = [array.array("B", bytes(self._WIDTH)) for _ in range(self._DEPTH)]
+        self._additions = 0
+        self._reset_at = 10 * self._WIDTH
+
+    def increment(self, key):
+        for row, i in zip(self._rows, self._indexes(key), strict=True):
+            if row[i] < self._MAX_COUNT:
+                row[i] += 1
+        self._additions += 1
+        if self._additions >= self._reset_at:
+            for row in self._rows:
+                for i, count in enumerate(row):
+                    row[i] = count >> 1
+            self._additions //= 2
+
+    def frequency(self, key):
+        return min(
+            row[i] for row, i in zip(self._rows, self._indexes(key), strict=True)
+        )
+
+    def _indexes(self, key):
+        return [hash((n, key)) % self._WIDTH for n in range(self._DEPTH)]
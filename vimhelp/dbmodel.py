@@ -40,6 +40,31 @@ class TagsInfo(ndb.Model):
     # [ ["t", "motion.txt.html#t"], ["perl", "if_perl.txt.html#perl"], ... ]
 
 
+# Serialized tag table of the translator ('VimH2H.tag_index()'), so that it needn't be
+# rebuilt from the tags file etc. on every update; key name is "vim" or "neovim".
+class TagIndex(ndb.Model):
+    inputs_key = ndb.BlobProperty(required=True)
+    # Hash over the identities (Git SHAs or HTTP ETags) of all files the tag table was
+    # built from; the index is only valid while this matches
+
+    data = ndb.BlobProperty(required=True, compressed=True)
+    # The serialized tag table
+
+
+# Tags defined by an unprocessed documentation file, so that unchanged files needn't be
+# fetched and scanned again to build the tag table; key name is e.g. "neovim:api.txt"
+class FileTagsInfo(ndb.Model):
+    project = ndb.StringProperty(required=True)
+    # Either "vim" or "neovim", always matches the entity key ID
+
+    git_sha = ndb.BlobProperty(required=True)
+    # Git SHA of the file the tags were extracted from; matches 'RawFileInfo.git_sha'
+    # while the tags are current
+
+    tags = ndb.JsonProperty(json_type=list)
+    # The tags, in order of appearance
+
+
 # Info related to an unprocessed documentation file from the repository; key name is
 # e.g. "vim:help.txt" or "neovim:api.txt"
 class RawFileInfo(ndb.Model):
@@ -82,8 +107,8 @@ class ProcessedFileHead(ndb.Model):
     # Time when this file was generated
 
     numparts = ndb.IntegerProperty(indexed=False)
-    # Number of parts; there will be 'numparts - 1' objects of kind 'ProcessedFilePart'
-    # in the database. Processed files are split up into parts as required by datastore
+    # Number of parts; the parts after the first are 'ProcessedFilePart' objects, see
+    # 'part_ids'. Processed files are split up into parts as required by datastore
     # blob limitations (currently these can only be up to 1 MiB in size)
 
     data0 = ndb.BlobProperty(required=True)
@@ -93,22 +118,86 @@ class ProcessedFileHead(ndb.Model):
     # Names and hashes of assets used by this HTML file. List elements match the
     # key names of "Asset" entities.
 
-
-# Part of a processed file; key name is "{project}:{basename}:{partnum}", e.g.
-# "neovim:help.txt:1".
+    translation_key = ndb.BlobProperty()
+    # 'VimH2H.translation_key()' of the refs in this file's 'TranslationInfo', for the
+    # translator that generated this file
+
+    source_hash = ndb.BlobProperty()
+    # SHA-1 of the raw file this file was generated from
+
+    numsections = ndb.IntegerProperty(indexed=False)
+    # Number of sections in the section index, or None if this file is too small to be
+    # divided into sections (and so has no section index)
+
+    gzipped = ndb.BooleanProperty(indexed=False)
+    # Whether this file has a gzip encoding
+
+    dcz_dict = ndb.BlobProperty()
+    # SHA-256 hash of the dictionary that the dcz encoding of this file (see
+    # 'vimhelp/dcz.py') was compressed against, or None if it has no such encoding
+
+    encoded_sections = ndb.BooleanProperty(indexed=False)
+    # Whether each encoding of this file consists of three parts rather than one: the
+    # encodings of the content up to the end of the first section, of the rest of the
+    # sections, and of what follows them (see 'vimhelp.split_ranges')
+
+    part_ids = ndb.JsonProperty(json_type=list, indexed=True)
+    # Key names of the 'ProcessedFilePart' objects that make up the rest of this file,
+    # in this order: the parts after the first; the section index, as zlib-compressed
+    # JSON (if 'numsections' is set); the gzip encoding (if 'gzipped' is set); and the
+    # dcz encoding (if 'dcz_dict' is set), each in one part or three (see
+    # 'encoded_sections'). Not set for files that were generated before parts were
+    # content-addressed; see 'part_keys'.
+
+    def part_keys(self):
+        """Return the keys of the parts that make up the rest of this file."""
+        if self.part_ids is None:
+            # Parts after the first, with key names "{project}:{basename}:{partnum}"
+            head_id = self.key.id()
+            return [
+                ndb.Key("ProcessedFilePart", f"{head_id}:{i}")
+                for i in range(1, self.numparts)
+            ]
+        return [ndb.Key("ProcessedFilePart", part_id) for part_id in self.part_ids]
+
+
+# Part of a processed file, or other data that goes with it (see
+# 'ProcessedFileHead.part_ids'); key name is the URL-safe base64 encoding of (a prefix
+# of) the SHA-256 hash of the data, e.g. "Bf0dmXMJ7zDytwK4kE2mbqXdG8AIKFv_".
 # This chunking is necessary because the maximum entity size in the Datastore is 1 MB:
 # see https://cloud.google.com/datastore/docs/concepts/limits
-# NOTE: vimhelp.py currently relies on the keynames, when sorted lexicographically,
-# yielding the correct order; this implies that we must never have a partnum with more
-# than one digit.
+# Since the key name follows from the data, parts are never overwritten with different
+# data, so a 'ProcessedFileHead' and its parts are always consistent, however they are
+# retrieved. Parts that are no longer used by any 'ProcessedFileHead' are deleted after
+# a grace period; see 'update.clean_unused_parts'.
 class ProcessedFilePart(ndb.Model):
     data = ndb.BlobProperty(required=True)
     # Contents
 
+    create_time = ndb.DateTimeProperty(indexed=False, auto_now_add=True)
+    # Time this entity was (last) written
+
+    unused_time = ndb.DateTimeProperty(indexed=False)
+    # Time as of which this entity is no longer in use
+
+
+# What is needed besides the raw file and the translation itself to reuse the
+# translation in a 'ProcessedFileHead' when the file is translated again (see
+# 'VimH2H.iter_html'); key name is e.g. "vim:faq.txt" or "neovim:help.txt". Saved
+# along with the 'ProcessedFileHead', in the same transaction. This is not part of the
+# 'ProcessedFileHead', which may not have room for it, and is not needed to serve it.
+class TranslationInfo(ndb.Model):
+    project = ndb.StringProperty(required=True)
+    # Either "vim" or "neovim", always matches the entity key ID
+
     etag = ndb.BlobProperty(required=True)
-    # Same value as corresponding 'ProcessedFileHead.etag'. Used when retrieving the
-    # 'ProcessedFileHead' and all its 'ProcessedFilePart's to ensure that they were
-    # retrieved consistently.
+    # 'ProcessedFileHead.etag' of the translation this is about
+
+    refs = ndb.JsonProperty(json_type=list, compressed=True)
+    # Sorted list of the texts that the translator looked up as tags
+
+    num_lines = ndb.IntegerProperty(indexed=False)
+    # Number of lines that the translator tokenized
 
 
 # Versioned static asset; key name is "{basename}:{hash}", e.g. "vimhelp.js:d34db33f".
@@ -0,0 +1,115 @@
+# Dictionary-compressed Zstandard ("dcz") content encoding, from Compression Dictionary
+# Transport (RFC 9842). Help pages have a lot of markup and vocabulary in common, so
+# compressing them against a dictionary of it (made by 'scripts/train_dict.py') makes
+# them a lot smaller than compressing each of them on its own does. The dictionary is
+# served as a static asset; pages point to it in their "Link" header, and once browsers
+# have it, they announce it in the "Available-Dictionary" header of their requests.
+
+import base64
+import binascii
+import functools
+import hashlib
+import importlib.resources
+
+try:
+    from compression import zstd
+except ImportError:
+    zstd = None
+
+DICT_NAME = "vimhelp.dict"
+
+# "Use-As-Dictionary" header of the dictionary: it applies to all pages of the site
+USE_AS_DICTIONARY = 'match="/*", match-dest=("document")'
+
+# Pages are compressed once per update rather than per request, but a higher level
+# would make compressing them much slower (and take more memory) for little gain
+ZSTD_LEVEL = 12
+
+# Decoders need not support windows larger than 8 MiB
+ZSTD_WINDOW_LOG = 23
+
+# A dcz response starts with this, followed by the SHA-256 hash of the dictionary, and
+# then consists of Zstandard frames
+_MAGIC = b"\x5e\x2a\x4d\x18\x20\x00\x00\x00"
+
+
+def enabled():
+    return zstd is not None
+
+
+@functools.cache
+def dict_content():
+    # This is a "raw content" dictionary, which is what browsers expect
+    return importlib.resources.files("vimhelp").joinpath(DICT_NAME).read_bytes()
+
+
+@functools.cache
+def dict_hash():
+    return hashlib.sha256(dict_content()).digest()
+
+
+def compressor(size):
+    """
+    Return a 'zstd.ZstdCompressor' that compresses a frame of exactly 'size' bytes
+    against the dictionary. The frame can follow the start of a dcz response returned
+    by 'prelude'. As the size is pledged, zstd sizes its window and match tables for
+    it, rather than for the largest window, which takes tens of MiB.
+    """
+    options = {
+        zstd.CompressionParameter.compression_level: ZSTD_LEVEL,
+        zstd.CompressionParameter.window_log: ZSTD_WINDOW_LOG,
+    }
+    result = zstd.ZstdCompressor(options=options, zstd_dict=_zstd_dict())
+    result.set_pledged_input_size(size)
+    return result
+
+
+@functools.cache
+def prelude(data):
+    """
+    Return the start of a dcz response: the header, and a frame of 'data'. Like the
+    frames that follow it, the frame is compressed against the dictionary (even
+    though it need not be), so that every frame of the response is one that decoders
+    are given the dictionary for.
+    """
+    return header() + frame(data)
+
+
+@functools.cache
+def header():
+    """
+    Return the header that every dcz response starts with, followed by its frames: the
+    magic number and the hash of the dictionary.
+    """
+    return _MAGIC + dict_hash()
+
+
+def frame(data):
+    """
+    Return a frame of 'data' compressed against the dictionary, which can follow the
+    start of a dcz response returned by 'prelude'.
+    """
+    c = compressor(len(data))
+    return c.compress(data) + c.flush()
+
+
+def available_dictionary(req):
+    """
+    Return the hash from the "Available-Dictionary" header of request 'req', or None if
+    it has none or the request does not accept dcz.
+    """
+    if req.accept_encodings["dcz"] <= 0:
+        return None
+    # The value is a structured field byte sequence, i.e. base64 between colons
+    value = req.headers.get("Available-Dictionary", "")
+    if len(value) < 2 or not value.startswith(":") or not value.endswith(":"):
+        return None
+    try:
+        return base64.b64decode(value[1:-1], validate=True)
+    except binascii.Error:
+        return None
+
+
+@functools.cache
+def _zstd_dict():
+    return zstd.ZstdDict(dict_content(), is_raw=True)
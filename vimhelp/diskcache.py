@@ -0,0 +1,202 @@
+import fcntl
+import json
+import logging
+import mmap
+import os
+import pathlib
+import threading
+
+# Default maximum size of the data file. This is kept small since the file may well be
+# in memory: on App Engine, the only writable directory is '/tmp', which is backed by
+# the instance's memory (on top of the in-process cache) and does not outlive it.
+DEFAULT_BUDGET = 16 * 1024 * 1024
+
+_DATA_NAME = "pages.data"
+_INDEX_NAME = "pages.index"
+
+
+class DiskCache:
+    """
+    Cache of pages in local files, which outlives the process: the second tier behind
+    the in-process 'cache.Cache', so that a process that starts cold gets pages from
+    local disk rather than from the datastore. Each page is stored once per ETag, as a
+    list of byte strings, in an append-only data file that is read through 'mmap'; an
+    append-only index file records where each page is and which ETag each project's
+    files have. This only helps where a restarted process finds the files of the
+    previous one (i.e. not on App Engine), so it is only used if
+    'VIMHELP_DISK_CACHE_DIR' is set; see 'webapp.create_app'.
+
+    A project's files are only looked up once 'validate' has confirmed that the index
+    is still up to date, i.e. that the project has not been updated since the index
+    recorded which ETag its files have. When the data file would outgrow 'budget'
+    bytes, the cache starts over.
+    """
+
+    def __init__(self, directory, budget=DEFAULT_BUDGET):
+        self._budget = budget
+        self._lock = threading.Lock()
+        # Dict mapping ETags to '(offset, lengths)' of the byte strings in the data file
+        self._pages = {}
+        # Dict mapping each project to the last update time (as a string) that the
+        # index is up to date with, and to a dict mapping file names to ETags
+        self._stamps = {}
+        self._names = {}
+        # Projects whose stamp 'validate' has confirmed
+        self._valid = set()
+        self._mmap = None
+        directory = pathlib.Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        self._index = (directory / _INDEX_NAME).open("a+")
+        # Appending to the files from several processes would interleave the records
+        try:
+            fcntl.flock(self._index, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._index.close()
+            raise
+        self._data = (directory / _DATA_NAME).open("a+b")
+        self._load_index()
+        logging.info(
+            "opened disk cache in %s with %d page(s)", directory, len(self._pages)
+        )
+
+    def get(self, project, name):
+        """
+        Return the list of byte strings stored for file 'name' of 'project', or None.
+        """
+        with self._lock:
+            if project not in self._valid:
+                return None
+            etag = self._names[project].get(name)
+            if etag is None:
+                return None
+            offset, lengths = self._pages[etag]
+            try:
+                mm = self._map(offset + sum(lengths))
+            except OSError as e:
+                logging.warning("failed to map disk cache: %s", e)
+                return None
+            result = []
+            for length in lengths:
+                result.append(mm[offset : offset + length])
+                offset += length
+            return result
+
+    def put(self, project, name, etag, blobs):
+        """
+        Store the list of byte strings 'blobs' for file 'name' of 'project', whose
+        ETag is 'etag' (a string). The page itself is not written again if a page with
+        that ETag is already stored, and not at all if it is larger than the budget.
+        """
+        with self._lock:
+            try:
+                if etag not in self._pages:
+                    self._write_page(etag, blobs)
+                if (
+                    etag in self._pages
+                    and project in self._valid
+                    and self._names[project].get(name) != etag
+                ):
+                    self._write_record(["name", project, name, etag])
+            except OSError as e:
+                logging.warning("failed to write to disk cache: %s", e)
+
+    def validate(self, update_times):
+        """
+        Confirm (or reset) the index for each project, given a dict mapping projects
+        to their 'GlobalInfo.last_update_time'. If the index records a different
+        update time for a project, the ETags of its files are forgotten, since they
+        may have changed; their pages stay, in case they have not.
+        """
+        with self._lock:
+            for project, update_time in update_times.items():
+                stamp = None if update_time is None else update_time.isoformat()
+                if project in self._stamps and self._stamps[project] == stamp:
+                    self._valid.add(project)
+                    continue
+                logging.info("disk cache of %s is out of date, resetting", project)
+                self._valid.discard(project)
+                try:
+                    self._write_record(["stamp", project, stamp])
+                except OSError as e:
+                    logging.warning("failed to write to disk cache: %s", e)
+                    continue
+                self._valid.add(project)
+
+    def close(self):
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+            self._data.close()
+            self._index.close()
+            self._valid.clear()
+
+    def _load_index(self):
+        data_len = os.fstat(self._data.fileno()).st_size
+        self._index.seek(0)
+        for line in self._index:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Incomplete last line, from a process that did not finish writing it
+                break
+            self._apply(record)
+        # Pages may be missing from the data file if a process did not finish writing
+        # them (which it does before it writes their records)
+        for etag, (offset, lengths) in list(self._pages.items()):
+            if offset + sum(lengths) > data_len:
+                del self._pages[etag]
+        for names in self._names.values():
+            for name, etag in list(names.items()):
+                if etag not in self._pages:
+                    del names[name]
+
+    def _apply(self, record):
+        match record:
+            case ["page", etag, offset, lengths]:
+                self._pages[etag] = offset, lengths
+            case ["stamp", project, stamp]:
+                self._stamps[project] = stamp
+                self._names[project] = {}
+            case ["name", project, name, etag] if project in self._names:
+                self._names[project][name] = etag
+
+    def _write_page(self, etag, blobs):
+        self._data.seek(0, os.SEEK_END)
+        offset = self._data.tell()
+        size = sum(map(len, blobs))
+        if offset + size > self._budget:
+            if size > self._budget:
+                return
+            self._reset()
+            offset = 0
+        for blob in blobs:
+            self._data.write(blob)
+        self._data.flush()
+        self._write_record(["page", etag, offset, [len(b) for b in blobs]])
+
+    def _write_record(self, record):
+        self._index.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._index.flush()
+        self._apply(record)
+
+    def _reset(self):
+        # Start over with empty files, keeping the stamps of the projects
+        logging.info("disk cache is full, starting over")
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._data.truncate(0)
+        self._index.truncate(0)
+        self._pages.clear()
+        for project, stamp in list(self._stamps.items()):
+            self._write_record(["stamp", project, stamp])
+
+    def _map(self, size):
+        # Return a map of the data file of at least 'size' bytes, remapping it if it
+        # has grown since it was last mapped
+        if self._mmap is None or len(self._mmap) < size:
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._data.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
@@ -1,4 +1,5 @@
 import bisect
+import sys
 
 import flask
 import werkzeug.exceptions
@@ -16,6 +17,8 @@ CACHE_KEY_ID = "api/tag-items"
 
 
 class TagItem:
+    __slots__ = ("href", "tag", "tag_lower")
+
     def __init__(self, tag, href):
         self.tag = tag
         self.tag_lower = tag.casefold()
@@ -36,12 +39,22 @@ def handle_tagsearch(cache):
             if entity is None:
                 raise werkzeug.exceptions.NotFound()
             items = [TagItem(*tag) for tag in entity.tags]
-            cache.put(project, CACHE_KEY_ID, items)
+            cache.put(project, CACHE_KEY_ID, items, items_size(items))
 
     results = do_handle_tagsearch(items, query)
     return flask.jsonify({"results": results})
 
 
+def items_size(items):
+    # Approximate number of bytes that 'items' takes in memory
+    size = sys.getsizeof(items)
+    for item in items:
+        size += sys.getsizeof(item) + sys.getsizeof(item.tag) + sys.getsizeof(item.href)
+        if item.tag_lower is not item.tag:
+            size += sys.getsizeof(item.tag_lower)
+    return size
+
+
 def do_handle_tagsearch(items, query):
     results = []
     result_set = set()
@@ -131,5 +131,61 @@ const onKeyDown = (e) => {
     }
 };
 addEventListener("keydown", onKeyDown);
+{% if mode == "online" %}
+
+
+// Lazy loading of large pages
+// With the "lazy" cookie set, the server leaves out everything after the first section
+// of a large page, putting a "vh-lazy" placeholder element in its place. The requests
+// for the content pass on the page's ETag from the placeholder, so that they cannot get
+// content from another version of the page: the server then responds with 412, and
+// the page is reloaded instead.
+
+const loadLazyContent = async (placeholder) => {
+    const etagParam = "&etag=" + encodeURIComponent(placeholder.dataset.etag);
+    const anchor = location.hash.slice(1);
+    if (anchor && !document.getElementById(anchor)) {
+        // Show the section that the URL fragment refers to first
+        const resp = await fetch("?anchor=" + encodeURIComponent(anchor) + etagParam);
+        if (resp.status === 412) {
+            location.reload();
+            return;
+        }
+        if (resp.ok) {
+            placeholder.innerHTML = await resp.text();
+            document.getElementById(anchor)?.scrollIntoView();
+        }
+    }
+    const resp = await fetch("?rest" + etagParam);
+    if (resp.status === 412) {
+        location.reload();
+        return;
+    }
+    if (!resp.ok) {
+        placeholder.textContent = "\n[Failed to load the rest of this page, please reload]\n";
+        return;
+    }
+    const html = await resp.text();
+    // Keep the element that the URL fragment refers to where it is on the screen
+    const target = anchor && document.getElementById(anchor);
+    const targetTop = target?.getBoundingClientRect().top;
+    placeholder.outerHTML = html;
+    if (target) {
+        scrollBy(0, document.getElementById(anchor).getBoundingClientRect().top - targetTop);
+    }
+    onResize();
+};
+
+if (!document.cookie.split("; ").includes("lazy=1")) {
+    const cookieDomain = location.hostname.replace(/^neo\./, "");
+    document.cookie =
+        `lazy=1; Secure; Domain=${cookieDomain}; SameSite=Lax; Path=/; Expires=Fri, 31 Dec 9999 23:59:59 GMT`;
+}
+
+const lazyPlaceholder = document.getElementById("vh-lazy");
+if (lazyPlaceholder) {
+    loadLazyContent(lazyPlaceholder);
+}
+{% endif %}
 
 {% endif %}
@@ -8,6 +8,7 @@ import json
 import logging
 import os
 import re
+import zlib
 from http import HTTPStatus
 
 import flask
@@ -20,18 +21,23 @@ import google.cloud.ndb
 import google.cloud.tasks
 
 from .dbmodel import (
+    FileTagsInfo,
     GlobalInfo,
     ProcessedFileHead,
     ProcessedFilePart,
     RawFileContent,
     RawFileInfo,
+    TagIndex,
     TagsInfo,
+    TranslationInfo,
     ndb_context,
 )
 from .http import HttpClient, HttpResponse
 from . import assets
+from . import dcz
 from . import secret
 from . import vimh2h
+from . import vimhelp
 
 
 # Once we have consumed about ten minutes of CPU time, Google will throw us a
@@ -48,6 +54,17 @@ CONCURRENCY = 5
 # Note that datastore entities have a maximum size of just under 1 MiB.
 MAX_DB_PART_LEN = 995000
 
+# zlib 'wbits' value that selects the gzip format
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# How long a 'ProcessedFilePart' must have been unused before it is deleted, so that
+# requests that retrieved an older 'ProcessedFileHead' can still retrieve its parts
+PART_DELETE_GRACE_PERIOD = datetime.timedelta(days=1)
+
+# Number of 'ProcessedFilePart's that 'clean_unused_parts' deletes or marks as unused in
+# a single transaction (each part is retrieved in it, and may be up to a MiB in size)
+PART_CLEAN_BATCH_SIZE = 20
+
 TAGS_NAME = "tags"
 HELP_NAME = "help.txt"
 FAQ_NAME = "vim_faq.txt"
@@ -135,6 +152,7 @@ class UpdateHandler(flask.views.MethodView):
             raise werkzeug.exceptions.Forbidden()
 
         is_force = b"force" in request_data
+        self._is_profile = b"profile" in request_data
 
         if b"project=vim" in request_data:
             self._project = "vim"
@@ -149,6 +167,11 @@ class UpdateHandler(flask.views.MethodView):
 
         self._app = flask.current_app._get_current_object()  # ty:ignore[unresolved-attribute]
         self._http_client = HttpClient(CONCURRENCY)
+        self._h2h = None
+        # 'RawFileContent's and 'TranslationInfo's of files that were translated last
+        # time, whose raw files have since been overwritten in the datastore, by name;
+        # see '_get_file_and_translate'
+        self._previous_raw_files = {}
 
         try:
             self._greenlet_pool = gevent.pool.Pool(size=CONCURRENCY)
@@ -175,6 +198,12 @@ class UpdateHandler(flask.views.MethodView):
                     )
 
             self._greenlet_pool.join()
+
+            if self._is_profile and self._h2h is not None:
+                logging.info(
+                    "Translator profile: %s",
+                    json.dumps(self._h2h.profile_stats(), sort_keys=True),
+                )
         finally:
             self._http_client.close()
 
@@ -276,17 +305,27 @@ class UpdateHandler(flask.views.MethodView):
 
         self._g.last_update_time = utcnow()
 
-        # Construct the vimhelp-to-html translator, providing it the tags file content,
-        # and adding on the extra files from which to source more tags
-        self._h2h = vimh2h.VimH2H(
-            mode="online",
-            project="vim",
-            version=version_from_tag(self._g.vim_version_tag),
-            tags=tags_result.content.decode(),
-        )
-        for name, result in extra_results.items():
-            if name != TAGS_NAME:
-                self._h2h.add_tags(name, result.content.decode())
+        # Construct the vimhelp-to-html translator. If the tags file and the extra
+        # files from which to source more tags are unchanged since we last did this, we
+        # can load the saved tag index; otherwise provide it the tags file content, add
+        # on the tags from the extra files, and save the resulting tag index.
+        version = version_from_tag(self._g.vim_version_tag)
+        tag_index_key = self._tag_index_key((*EXTRA_NAMES, FAQ_NAME))
+        self._h2h = self._load_tag_index(tag_index_key, version)
+        save_tag_index = False
+        if self._h2h is None:
+            self._h2h = vimh2h.VimH2H(
+                mode="online",
+                project="vim",
+                version=version,
+                tags=tags_result.content.decode(),
+                static_path=assets.static_path,
+                profile=self._is_profile,
+            )
+            for name, result in extra_results.items():
+                if name != TAGS_NAME:
+                    self._h2h.add_tags(name, result.content)
+            save_tag_index = tag_index_key is not None
 
         # Ensure all assets are in the datastore by now
         assets_greenlet.get()
@@ -300,6 +339,9 @@ class UpdateHandler(flask.views.MethodView):
         if any(result.is_modified for result in extra_results.values()):
             track_spawn(self._save_tags_json)
 
+        if save_tag_index:
+            track_spawn(self._save_tag_index, tag_index_key)
+
         # Translate each extra file if either it, or the tags file, was modified
         # (a changed tags file can lead to different outgoing links)
         for name, result in extra_results.items():
@@ -354,23 +396,44 @@ class UpdateHandler(flask.views.MethodView):
             mode="online",
             project="neovim",
             version=version_from_tag(self._g.vim_version_tag),
+            static_path=assets.static_path,
+            profile=self._is_profile,
         )
 
         # Iterate over doc dirs listing (which also updates the items in
-        # 'self._rfi_map'), kicking off retrieval of files and addition of help tags to
-        # 'self._h2h'; file retrieval also includes writing the raw file to the
-        # datastore if modified
-        all_file_names = set()
-        for name, is_modified in docdir_greenlet.get():
-            all_file_names.add(name)
+        # 'self._rfi_map'). The tags of files whose Git SHA is unchanged since their
+        # tags were last extracted are taken from the datastore; for all other files,
+        # kick off retrieval of the file and extraction of its tags. File retrieval
+        # also includes writing the raw file to the datastore if modified.
+        docdir = dict(docdir_greenlet.get())
+        all_file_names = set(docdir)
+        file_tags = self._get_cached_file_tags(sorted(all_file_names))
+        tags_greenlets = {}
+        for name, is_modified in docdir.items():
+            if not is_modified and name in file_tags:
+                continue
             sources = "http,db" if is_modified else "db"
-            self._spawn(self._get_file_and_add_tags, name, sources)
+            tags_greenlets[name] = self._spawn(
+                self._get_file_and_extract_tags, name, sources
+            )
+        logging.info(
+            "Using cached tags of %d file(s), extracting tags from %d file(s)",
+            len(all_file_names) - len(tags_greenlets),
+            len(tags_greenlets),
+        )
 
-        # Wait for all tag additions to complete
-        self._greenlet_pool.join(raise_error=True)
+        # Wait for all tag extractions to complete, then add all tags to 'self._h2h'
+        # in a well-defined order, and save the newly extracted tags
+        for name, greenlet in tags_greenlets.items():
+            file_tags[name] = greenlet.get()
+        for name in sorted(file_tags):
+            self._h2h.add_tag_list(name, file_tags[name])
+        greenlets = [
+            self._spawn(self._save_file_tags, {n: file_tags[n] for n in tags_greenlets})
+        ]
 
         # Save tags JSON
-        greenlets = [self._spawn(self._save_tags_json)]
+        greenlets.append(self._spawn(self._save_tags_json))
 
         # Ensure all assets are in the datastore by now
         assets_greenlet.get()
@@ -541,6 +604,57 @@ class UpdateHandler(flask.views.MethodView):
         logging.info("Saving %d %s (tag, href) pairs", len(tags), self._project)
         TagsInfo(id=self._project, tags=tags).put()
 
+    def _tag_index_key(self, names):
+        """
+        Return a key identifying the contents of the files with the given 'names', for
+        use as 'TagIndex.inputs_key', or None if not all of them can be identified.
+        Files are identified by their Git SHA if known, else by their HTTP ETag.
+        """
+        digest = hashlib.sha1()  # noqa: S324
+        digest.update(f"{vimh2h.TAG_INDEX_VERSION}\n".encode())
+        for name in sorted(names):
+            rfi = self._rfi_map.get(name)
+            ident = rfi and (rfi.git_sha or rfi.etag)
+            if not ident:
+                logging.info("No identity for '%s:%s'", self._project, name)
+                return None
+            digest.update(f"{name}:".encode() + ident + b"\n")
+        return digest.digest()
+
+    def _load_tag_index(self, tag_index_key, version):
+        """
+        Construct translator from the saved tag index if its key matches
+        'tag_index_key'; return None if that is not possible.
+        """
+        if tag_index_key is None:
+            return None
+        tag_index = TagIndex.get_by_id(self._project)
+        if tag_index is None:
+            logging.info("No %s tag index found", self._project)
+            return None
+        if tag_index.inputs_key != tag_index_key:
+            logging.info("%s tag index is out of date", self._project)
+            return None
+        try:
+            h2h = vimh2h.VimH2H(
+                mode="online",
+                project=self._project,
+                version=version,
+                tag_index=tag_index.data,
+                static_path=assets.static_path,
+                profile=self._is_profile,
+            )
+        except ValueError as e:
+            logging.warning("Cannot load %s tag index: %s", self._project, e)
+            return None
+        logging.info("Loaded %s tag index", self._project)
+        return h2h
+
+    def _save_tag_index(self, tag_index_key):
+        data = self._h2h.tag_index()
+        logging.info("Saving %s tag index (%d bytes)", self._project, len(data))
+        TagIndex(id=self._project, inputs_key=tag_index_key, data=data).put()
+
     def _get_file_and_translate(self, name, translate_if_not_modified, sources=None):
         """
         Get file with given 'name' and translate to HTML.
@@ -551,23 +665,109 @@ class UpdateHandler(flask.views.MethodView):
         """
         if sources is None:
             sources = "http,db" if translate_if_not_modified else "http"
-        result = self._get_file(name, sources)
+        previous_raw_file = self._previous_raw_files.pop(name, None)
+        rfc = None
+        if previous_raw_file is None:
+            # This must happen before '_get_file' overwrites the raw file in the
+            # datastore
+            previous_raw_file = self._get_stored(name, RawFileContent, TranslationInfo)
+            rfc = previous_raw_file[0]
+        result = self._get_file(name, sources, rfc)
         if translate_if_not_modified or result.is_modified:
-            self._translate(name, result.content)
+            previous = self._get_previous_translation(name, *previous_raw_file)
+            self._translate(name, result.content, previous)
 
-    def _get_file_and_add_tags(self, name, sources):
+    def _get_stored(self, name, *models):
         """
-        Get file with given 'name' and add tags from it to 'self._h2h'.
+        Return the entities of the given 'models' for the file with given 'name' as
+        currently in the Datastore (None for those that do not exist), retrieved in a
+        single round trip.
+        """
+        head_id = f"{self._project}:{name}"
+        keys = [google.cloud.ndb.Key(model, head_id) for model in models]
+        return google.cloud.ndb.get_multi(keys)
+
+    def _get_previous_translation(self, name, rfc, info):
+        """
+        Return a '(contents, html, info)' triple for 'VimH2H.iter_html' holding the
+        raw file with given 'name' from 'rfc' (its 'RawFileContent', as retrieved
+        before it was overwritten if it has been), the HTML translation of it as
+        currently in the Datastore (as an iterable of chunks, which are retrieved as
+        they are needed) and the refs and number of lines from 'info' (its
+        'TranslationInfo'), if that translation was made from that raw file by a
+        translator that translates its lines the same way as 'self._h2h' (so that
+        'self._h2h' can reuse parts of it); else return None.
+        """
+        if rfc is None or info is None:
+            return None
+        head_id = f"{self._project}:{name}"
+        head = ProcessedFileHead.get_by_id(head_id)
+        if head is None or head.etag != info.etag:
+            return None
+        if head.source_hash != sha1(rfc.data):
+            return None
+        if head.translation_key != self._h2h.translation_key(info.refs):
+            return None
+        logging.info("Found reusable translation of '%s'", head_id)
+        html = iter_parts(head.data0, head.part_keys()[: head.numparts - 1])
+        return rfc.data, html, {"refs": info.refs, "num_lines": info.num_lines}
+
+    def _get_file_and_extract_tags(self, name, sources):
+        """
+        Get file with given 'name' and return the list of tags defined in it.
         'sources' is as for '_get_file'.
         """
+        if "http" in sources:
+            # The raw file is translated later on, after '_get_file' has overwritten
+            # it in the datastore; see '_get_file_and_translate'
+            self._previous_raw_files[name] = self._get_stored(
+                name, RawFileContent, TranslationInfo
+            )
         result = self._get_file(name, sources)
-        self._h2h.add_tags(name, result.content.decode())
+        return vimh2h.VimH2H.extract_tags(result.content)
 
-    def _get_file(self, name, sources):
+    def _get_cached_file_tags(self, names):
+        """
+        Return dict mapping those of the given file 'names' whose tags in the
+        datastore are current (as per 'self._rfi_map') to their list of tags.
+        """
+        keys = [
+            google.cloud.ndb.Key("FileTagsInfo", f"{self._project}:{name}")
+            for name in names
+        ]
+        result = {}
+        for name, fti in zip(names, google.cloud.ndb.get_multi(keys), strict=True):
+            rfi = self._rfi_map.get(name)
+            if fti is not None and rfi is not None and fti.git_sha == rfi.git_sha:
+                result[name] = fti.tags
+        return result
+
+    def _save_file_tags(self, file_tags):
+        """
+        Save the given dict mapping file names to their list of tags to the datastore,
+        along with the Git SHA (as per 'self._rfi_map') the tags were extracted from.
+        """
+        entities = [
+            FileTagsInfo(
+                id=f"{self._project}:{name}",
+                project=self._project,
+                git_sha=self._rfi_map[name].git_sha,
+                tags=tags,
+            )
+            for name, tags in file_tags.items()
+            if self._rfi_map[name].git_sha is not None
+        ]
+        if len(entities) > 0:
+            logging.info("Saving tags of %d %s file(s)", len(entities), self._project)
+            google.cloud.ndb.put_multi(entities)
+
+    def _get_file(self, name, sources, rfc=None):
         """
         Get file with given 'name' via HTTP and/or from the Datastore, based on
         'sources', which should be one of "http", "db", "http,db". If a new/modified
         file was retrieved via HTTP, save raw file (info) to Datastore as needed.
+        'rfc' may be the file's 'RawFileContent' as just retrieved from the Datastore,
+        which is then not retrieved again.
         """
         rfi = self._rfi_map.get(name)
         result = None
@@ -593,9 +793,10 @@ class UpdateHandler(flask.views.MethodView):
                 return result
 
         if "db" in sources_set:
-            logging.info("Fetching '%s:%s' from datastore", self._project, name)
-            rfc = RawFileContent.get_by_id(f"{self._project}:{name}")
-            logging.info("Fetched '%s:%s' from datastore", self._project, name)
+            if rfc is None:
+                logging.info("Fetching '%s:%s' from datastore", self._project, name)
+                rfc = RawFileContent.get_by_id(f"{self._project}:{name}")
+                logging.info("Fetched '%s:%s' from datastore", self._project, name)
             return GetFileResult(rfc)
 
         return result
@@ -613,16 +814,23 @@ class UpdateHandler(flask.views.MethodView):
         else:
             return f"{base}/runtime/doc/{name}"
 
-    def _translate(self, name, content):
+    def _translate(self, name, content, previous=None):
         """
-        Translate given file to HTML and save to Datastore.
+        Translate given file to HTML and save to Datastore. 'previous' is as returned
+        by '_get_previous_translation'.
         """
-        logging.info("Translating '%s:%s' to HTML", self._project, name)
-        phead, pparts = to_html(self._project, name, content, self._h2h)
+        logging.info(
+            "Translating '%s:%s' to HTML%s",
+            self._project,
+            name,
+            "" if previous is None else " incrementally",
+        )
+        entities = to_html(self._project, name, content, self._h2h, previous)
         logging.info(
             "Saving HTML translation of '%s:%s' to Datastore", self._project, name
         )
-        save_transactional([phead, *pparts])
+        save_transactional(entities)
+        logging.info("Translator cache stats: %s", self._h2h.cache_stats())
 
     def _get_all_rfi(self, no_rfi):
         if no_rfi:
@@ -664,47 +872,200 @@ class GetFileResult:
             self.is_modified = False
 
 
-def to_html(project, name, content, h2h):
-    content_str = content.decode()
-    html = h2h.to_html(name, content_str).encode()
-    etag = base64.b64encode(sha1(html))
-    datalen = len(html)
+def to_html(project, name, content, h2h, previous=None):
+    # Build the datastore entities straight from the translator's output stream, so
+    # that the page only exists in memory once, in the form of the parts. The raw
+    # file is handed to the translator as bytes, which it decodes line by line, so
+    # neither does it exist in memory twice. The page is then gzip-compressed and, if
+    # possible, dcz-compressed, so that it can be served compressed without compressing
+    # it per request. A page that is large enough to be divided into sections is
+    # compressed in three ranges (see 'vimhelp.split_ranges'), which together make up
+    # the encoding of the whole page, so that its lazy version and the rest can be
+    # served compressed too. Returns the 'ProcessedFileHead', the 'TranslationInfo'
+    # and the 'ProcessedFilePart's (see 'ProcessedFileHead.part_ids'): the parts after
+    # the first, the section index if the page is divided into sections, and the
+    # encodings (unless they would exceed a single entity per range).
+    digest = hashlib.sha1()  # noqa: S324
+    parts = []
+    sections = []
+    info = {}
+    buf = bytearray()
+    for chunk in h2h.iter_html(name, content, previous, sections, info):
+        digest.update(chunk)
+        buf += chunk
+        while len(buf) >= MAX_DB_PART_LEN:
+            parts.append(bytes(buf[:MAX_DB_PART_LEN]))
+            del buf[:MAX_DB_PART_LEN]
+    if len(buf) > 0 or len(parts) == 0:
+        parts.append(bytes(buf))
+    del buf
+    if len(sections) > 1:
+        ranges = vimhelp.split_ranges(sections)
+    else:
+        ranges = ((0, None),)
+    range_pieces = vimhelp.get_ranges(parts, ranges)
+    gzip_members = [gzip_compress(pieces) for pieces in range_pieces]
+    dcz_frames = None
+    if dcz.enabled():
+        dcz_frames = [dcz_compress(pieces) for pieces in range_pieces]
+    del range_pieces
+    etag = base64.b64encode(digest.digest())
+    refs = sorted(info["refs"])
     phead = ProcessedFileHead(
         id=f"{project}:{name}",
         project=project,
         encoding=b"UTF-8",
         etag=etag,
         used_assets=assets.curr_asset_ids(),
+        numparts=len(parts),
+        data0=parts[0],
+        translation_key=h2h.translation_key(refs),
+        source_hash=sha1(content),
     )
-    pparts = []
-    if datalen > MAX_DB_PART_LEN:
-        phead.numparts = 0
-        for i in range(0, datalen, MAX_DB_PART_LEN):
-            part = html[i : (i + MAX_DB_PART_LEN)]
-            if i == 0:
-                phead.data0 = part
-            else:
-                partname = f"{project}:{name}:{phead.numparts}"
-                pparts.append(ProcessedFilePart(id=partname, data=part, etag=etag))
-            phead.numparts += 1
-    else:
-        phead.numparts = 1
-        phead.data0 = html
-    return phead, pparts
+    tinfo = TranslationInfo(
+        id=f"{project}:{name}",
+        project=project,
+        etag=etag,
+        refs=refs,
+        num_lines=info["num_lines"],
+    )
+    rest = parts[1:]
+    if len(sections) > 1:
+        phead.numsections = len(sections)
+        phead.encoded_sections = True
+        rest.append(zlib.compress(json.dumps(sections).encode()))
+    if max(map(len, gzip_members)) <= MAX_DB_PART_LEN:
+        phead.gzipped = True
+        rest += gzip_members
+    if dcz_frames is not None and max(map(len, dcz_frames)) <= MAX_DB_PART_LEN:
+        phead.dcz_dict = dcz.dict_hash()
+        rest += dcz_frames
+    part_entities = [ProcessedFilePart(id=part_id(data), data=data) for data in rest]
+    phead.part_ids = [p.key.id() for p in part_entities]
+    # Writing a part that already exists (with the same data, as it has the same key
+    # name) just marks it as used again
+    unique_parts = {p.key.id(): p for p in part_entities}
+    return [phead, tinfo, *unique_parts.values()]
+
+
+def gzip_compress(pieces):
+    # A gzip member of the concatenation of 'pieces'
+    compressor = zlib.compressobj(9, zlib.DEFLATED, GZIP_WBITS)
+    result = [compressor.compress(piece) for piece in pieces]
+    result.append(compressor.flush())
+    return b"".join(result)
+
+
+def dcz_compress(pieces):
+    # A dcz frame of the concatenation of 'pieces' (see 'dcz.frame')
+    compressor = dcz.compressor(sum(map(len, pieces)))
+    result = [compressor.compress(piece) for piece in pieces]
+    result.append(compressor.flush())
+    return b"".join(result)
+
+
+def iter_parts(data0, part_keys):
+    # Yields 'data0' and then the data of the 'ProcessedFilePart's with keys
+    # 'part_keys', each retrieved only when it is needed; stops at a missing part
+    yield data0
+    for key in part_keys:
+        if (part := key.get()) is None:
+            return
+        yield part.data
+
+
+def part_id(data):
+    # Key name of the 'ProcessedFilePart' holding 'data'
+    return base64.urlsafe_b64encode(hashlib.sha256(data).digest()[:24]).decode()
+
+
+def clean_unused_parts():
+    # Like 'assets.clean_unused_assets', but for 'ProcessedFilePart's. Parts with key
+    # names containing ":" are from before parts were content-addressed; they may still
+    # be used by 'ProcessedFileHead's without 'part_ids', so they are left alone. A part
+    # may be used again, by a 'ProcessedFileHead' that is saved after the query for
+    # which parts are used, so each part is checked again in the transaction that
+    # deletes or marks it; see 'clean_parts_transactional'.
+    logging.info("Cleaning up unused processed file parts")
+    with ndb_context():
+        now = utcnow()
+        recent = now - PART_DELETE_GRACE_PERIOD
+        all_part_ids = {
+            key.id()
+            for key in ProcessedFilePart.query().iter(keys_only=True)
+            if ":" not in key.id()
+        }
+        pfh_query = ProcessedFileHead.query(projection=["part_ids"])
+        used_part_ids = set(itertools.chain(*(pfh.part_ids for pfh in pfh_query)))
+        unused_part_keys = [
+            google.cloud.ndb.Key("ProcessedFilePart", i)
+            for i in all_part_ids - used_part_ids
+        ]
+        due_keys = [
+            part.key
+            for part in google.cloud.ndb.get_multi(unused_part_keys)
+            if part is not None and get_part_cleaning(part, recent) is not None
+        ]
+        if len(due_keys) == 0:
+            logging.info("No processed file parts need cleaning")
+            return
+        num_deleted = num_marked = 0
+        for i in range(0, len(due_keys), PART_CLEAN_BATCH_SIZE):
+            batch = due_keys[i : i + PART_CLEAN_BATCH_SIZE]
+            deleted, marked = clean_parts_transactional(batch, now, recent)
+            num_deleted += deleted
+            num_marked += marked
+        logging.info(
+            "Deleted %d old processed file part(s) and marked %d as unused",
+            num_deleted,
+            num_marked,
+        )
+
+
+@google.cloud.ndb.transactional(xg=True)
+def clean_parts_transactional(keys, now, recent):
+    # Deletes or marks as unused those of the 'ProcessedFilePart's with keys 'keys'
+    # that are (still) due for it; returns how many of each. A part that has been
+    # written again since it was found to be unused is not, as that resets its
+    # 'create_time' and 'unused_time'.
+    to_delete = []
+    to_put = []
+    for part in google.cloud.ndb.get_multi(keys):
+        if part is None:
+            continue
+        match get_part_cleaning(part, recent):
+            case "delete":
+                to_delete.append(part.key)
+            case "mark":
+                part.unused_time = now
+                to_put.append(part)
+    google.cloud.ndb.delete_multi(to_delete)
+    google.cloud.ndb.put_multi(to_put)
+    return len(to_delete), len(to_put)
+
+
+def get_part_cleaning(part, recent):
+    # Returns what is due for the unused 'ProcessedFilePart' 'part', given the time
+    # before which its grace period must have started: "delete", "mark" (as unused), or
+    # None
+    if part.create_time >= recent:
+        return None
+    if part.unused_time is None:
+        return "mark"
+    if part.unused_time < recent:
+        return "delete"
+    return None
 
 
 def save_raw_file(rfi, content):
+    # We save the content of all files, not just of those we may need to retranslate
+    # without fetching them again, since it also serves as the base for incremental
+    # retranslation (see 'UpdateHandler._get_previous_translation').
     rfi_id = rfi.key.id()
-    project, name = rfi_id.split(":")
-    if project == "neovim" or name in (HELP_NAME, FAQ_NAME, *EXTRA_NAMES):
-        logging.info("Saving raw file '%s' (info and content) to Datastore", rfi_id)
-        rfc = RawFileContent(
-            id=rfi_id, project=project, data=content, encoding=b"UTF-8"
-        )
-        save_transactional([rfi, rfc])
-    else:
-        logging.info("Saving raw file '%s' (info only) to Datastore", rfi_id)
-        rfi.put()
+    project = rfi_id.split(":")[0]
+    logging.info("Saving raw file '%s' (info and content) to Datastore", rfi_id)
+    rfc = RawFileContent(id=rfi_id, project=project, data=content, encoding=b"UTF-8")
+    save_transactional([rfi, rfc])
 
 
 def wipe_db(model, project):
@@ -725,9 +1086,7 @@ def version_from_tag(version_tag):
 
 
 def sha1(content):
-    digest = hashlib.sha1()  # noqa: S324
-    digest.update(content)
-    return digest.digest()
+    return hashlib.sha1(content).digest()  # noqa: S324
 
 
 def utcnow():
@@ -735,6 +1094,58 @@ def utcnow():
     return datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
 
 
+class CleanPartsHandler(flask.views.MethodView):
+    def get(self):
+        if (
+            os.environ.get("VIMHELP_ENV") != "dev"
+            and secret.admin_password().encode() not in flask.request.query_string
+        ):
+            raise werkzeug.exceptions.Forbidden()
+        clean_unused_parts()
+        return "Success."
+
+    def post(self):
+        # https://cloud.google.com/tasks/docs/creating-appengine-handlers#reading_app_engine_task_request_headers
+        if "X-AppEngine-QueueName" not in flask.request.headers:
+            raise werkzeug.exceptions.Forbidden()
+        clean_unused_parts()
+        return flask.Response()
+
+
+def handle_enqueue_clean_parts():
+    req = flask.request
+
+    is_cron = req.headers.get("X-Appengine-Cron") == "true"
+
+    # https://cloud.google.com/appengine/docs/standard/scheduling-jobs-with-cron-yaml#securing_urls_for_cron
+    if (
+        not is_cron
+        and os.environ.get("VIMHELP_ENV") != "dev"
+        and secret.admin_password().encode() not in req.query_string
+    ):
+        raise werkzeug.exceptions.Forbidden()
+
+    logging.info("Enqueueing processed file parts clean")
+
+    client = google.cloud.tasks.CloudTasksClient()
+    queue_name = client.queue_path(
+        os.environ["GOOGLE_CLOUD_PROJECT"], "us-central1", "update2"
+    )
+    task = {
+        "app_engine_http_request": {
+            "http_method": "POST",
+            "relative_uri": "/clean_parts",
+        }
+    }
+    response = client.create_task(parent=queue_name, task=task)  # ty:ignore[invalid-argument-type]
+    logging.info("Task %s enqueued, ETA %s", response.name, response.schedule_time)
+
+    if is_cron:
+        return flask.Response()
+    else:
+        return "Successfully enqueued processed file parts clean task."
+
+
 def handle_enqueue_update():
     req = flask.request
 
@@ -1,11 +1,21 @@
 # Translates Vim documentation to HTML
 
+import array
+import collections
+import contextlib
+import copy
 import functools
+import hashlib
 import html
+import itertools
+import pathlib
 import re
+import struct
+import sys
+import time
 import urllib.parse
 
-import flask
+import jinja2
 import markupsafe
 
 
@@ -110,41 +120,261 @@ RE_SECTION = re.compile(
 RE_STARTAG = re.compile(r'\*([^ \t"*]+)\*(?:\s|$)')
 RE_LOCAL_ADD = re.compile(r".*\s\*local-additions\*$")
 
+# Used by the "lexer" engine. A line in which RE_TOKEN_TRIGGER finds nothing cannot
+# contain any RE_TAGWORD token other than PAT_WORD, so it can be split into words with
+# RE_WORD_SPLIT instead. Separators between words never contain characters that need
+# HTML-escaping, nor (in the absence of concealed chars) tabs that need fixing.
+RE_TOKEN_TRIGGER = re.compile(
+    r"[|*`'<{\[]|~$|CTRL|META|ALT|Vim version|VIM REFERENCE|[Nn]ote|NOTE|://"
+)
+RE_WORD_SPLIT = re.compile("(" + PAT_WORDCHAR + "+)")
+SECTION_START_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZ.")
+EG_START_SUFFIXES = ">", ">vim", ">vim9", ">lua"
+
+# Serialized 'TagTable' format: header (magic, version, number of files, number of
+# tags), then the file number of each tag as little-endian 16-bit integers, then the
+# NUL-separated filenames followed by the NUL-separated tags, UTF-8 encoded.
+TAG_INDEX_MAGIC = b"VHTI"
+TAG_INDEX_VERSION = 1
+TAG_INDEX_HEADER = struct.Struct("<4sHHI")
+
+# Default maximum number of entries in the translator's cache of HTML-escaped strings
+ESCAPE_CACHE_SIZE = 65536
+
+# Used by compact mode (see 'VimH2H.__init__'). Since all text is HTML-escaped, every
+# "<" in the content starts a tag made by the translator; such tags never contain ">".
+RE_COMPACT_UNLINKED = re.compile(r'<span class="l">([^<]*)</span>')
+RE_COMPACT_TAG = re.compile(r"<(?:a|span) [^>]*>")
+RE_COMPACT_QUOTED = re.compile(r'="([^\s"\'=<>`]+)"')
+RE_COMPACT_RUN = re.compile(
+    r"<span class=([a-z])>[^<]*</span>(?:\n<span class=\1>[^<]*</span>)+"
+)
+
+# Placeholders for the per-file parts of page.html, which 'VimH2H' renders only once
+# as a skeleton (see '_page_skeleton') and then fills in for each file
+RE_PAGE_SLOT = re.compile("\0(filename|sidebar|content)\0")
+
+# What page.html puts immediately around the content
+CONTENT_START = '<div id="vh-content">\n<pre>\n'
+CONTENT_END = "\n</pre>\n</div>"
+
+# Placeholder for the tokens of a line in 'VimH2H._reusing_tokenizer'
+TOKENS_MARKER = "\0"
+
+# Part of 'VimH2H.translation_key()'; must be incremented whenever a change to the
+# translator changes its output for any line
+TRANSLATION_FORMAT_VERSION = 2
+
+# Number of HTML fragments, or of lines, that 'VimH2H.iter_html' collects before
+# yielding a chunk, whichever comes first (a line whose translation is reused is a
+# single fragment)
+STREAM_CHUNK_PIECES = 16384
+STREAM_CHUNK_LINES = 2048
+
+# Approximate size of the blocks (in characters, or in bytes for UTF-8 encoded input)
+# that the contents of a file are split into lines in
+SPLIT_BLOCK_SIZE = 65536
+
+# Approximate size in bytes of the sections that 'VimH2H.iter_html' divides the content
+# into, and the anchors (element ids) that it finds in them
+SECTION_BYTES = 65536
+RE_ANCHOR = re.compile(rb'<span id="?([^"\s>]+)')
 
-class Link:
-    def __init__(self, filename, htmlfilename, tag):
-        self.filename = filename
+# RE_TAGWORD group numbers, as reported by 'match.lastindex'
+# fmt: off
+(TOK_HEADER, TOK_GRAPHIC, TOK_PIPEWORD, TOK_STARWORD, TOK_COMMAND, TOK_OPT, TOK_CTRL,
+ TOK_SPECIAL, TOK_TITLE, TOK_NOTE, TOK_URL, TOK_WORD) = range(1, 13)
+# fmt: on
+
+# Names of the RE_TAGWORD groups in profiling stats (see 'VimH2H.profile_stats'), and
+# the groups whose text the translator looks up as a tag
+TOKEN_NAMES = (
+    "header", "graphic", "pipeword", "starword", "command", "opt", "ctrl", "special",
+    "title", "note", "url", "word",
+)  # fmt: skip
+LINK_TOKENS = frozenset((TOK_PIPEWORD, TOK_OPT, TOK_CTRL, TOK_SPECIAL, TOK_WORD))
+
+# Phases timed when profiling (see 'VimH2H.profile_stats')
+PROFILE_PHASES = "tags_parse", "extract_tags", "add_tags", "translate", "render"
+
+
+class TagTable:
+    """
+    Maps each tag to the help file that defines it, and produces the HTML for links to
+    tags. With well over 10k tags, storage is kept compact: a dict from tag to tag
+    number, and parallel arrays indexed by tag number. The link HTML for each of the
+    four (is_pipe, is_same_doc) variants of a tag is only built when first needed.
+    """
+
+    __slots__ = (
+        "_file_nums",
+        "_filename_nums",
+        "_filenames",
+        "_html",
+        "_htmlfilename",
+        "_htmlfilenames",
+        "_index",
+        "_tags",
+    )
+
+    def __init__(self, htmlfilename):
         self._htmlfilename = htmlfilename
-        if tag == "help-tags" and filename == "tags":
-            self._tag_quoted = None
-        else:
-            self._tag_quoted = urllib.parse.quote_plus(tag)
-        self._tag_escaped = _html_escape(tag)
-        self._cssclass = "d"
-        if m := RE_LINKWORD.match(tag):
-            opt, ctrl, special = m.groups()
-            if opt is not None:
-                self._cssclass = "o"
-            elif ctrl is not None:
-                self._cssclass = "k"
-            elif special is not None:
-                self._cssclass = "s"
-
-    @functools.cache  # noqa: B019
-    def href(self, is_same_doc):
-        if self._tag_quoted is None:
-            return self._htmlfilename
-        doc = "" if is_same_doc else self._htmlfilename
-        return f"{doc}#{self._tag_quoted}"
-
-    @functools.cache  # noqa: B019
-    def html(self, is_pipe, is_same_doc):
-        cssclass = "l" if is_pipe else self._cssclass
-        return (
-            f'<a href="{self.href(is_same_doc)}" class="{cssclass}">'
-            f"{self._tag_escaped}</a>"
+        self._index = {}  # tag -> tag number
+        self._tags = []  # tag number -> tag
+        self._file_nums = array.array("H")  # tag number -> file number
+        self._html = []  # 4 * tag number + 2 * is_pipe + is_same_doc -> HTML or None
+        self._filenames = []  # file number -> filename
+        self._htmlfilenames = []  # file number -> HTML filename
+        self._filename_nums = {}  # filename -> file number
+
+    def __len__(self):
+        return len(self._tags)
+
+    def to_bytes(self):
+        """Serialize the table; 'TagTable.from_bytes' is the inverse."""
+        file_nums = array.array("H", self._file_nums)
+        if sys.byteorder != "little":
+            file_nums.byteswap()
+        strings = "\0".join(itertools.chain(self._filenames, self._tags))
+        return b"".join(
+            (
+                TAG_INDEX_HEADER.pack(
+                    TAG_INDEX_MAGIC,
+                    TAG_INDEX_VERSION,
+                    len(self._filenames),
+                    len(self._tags),
+                ),
+                file_nums.tobytes(),
+                strings.encode(),
+            )
         )
 
+    @classmethod
+    def from_bytes(cls, data, htmlfilename):
+        """
+        Load a table serialized by 'to_bytes' from 'data', which may be any bytes-like
+        object (e.g. an mmap). Raises ValueError if 'data' is not a valid serialized
+        table of the current version.
+        """
+        data = memoryview(data)
+        try:
+            magic, version, num_files, num_tags = TAG_INDEX_HEADER.unpack_from(data)
+        except struct.error as e:
+            raise ValueError("truncated tag index") from e
+        if magic != TAG_INDEX_MAGIC or version != TAG_INDEX_VERSION:
+            raise ValueError(f"unsupported tag index {magic!r} version {version}")
+        offset = TAG_INDEX_HEADER.size
+        strings_offset = offset + 2 * num_tags
+        file_nums = array.array("H")
+        file_nums.frombytes(data[offset:strings_offset])
+        if sys.byteorder != "little":
+            file_nums.byteswap()
+        text = str(data[strings_offset:], "utf-8")
+        strings = text.split("\0") if text else []
+        if len(file_nums) != num_tags or len(strings) != num_files + num_tags:
+            raise ValueError("truncated tag index")
+
+        table = cls(htmlfilename)
+        table._filenames = strings[:num_files]
+        table._htmlfilenames = [htmlfilename(f) for f in table._filenames]
+        table._filename_nums = {f: i for i, f in enumerate(table._filenames)}
+        table._tags = strings[num_files:]
+        table._index = dict(zip(table._tags, range(num_tags), strict=True))
+        table._file_nums = file_nums
+        table._html = [None] * (4 * num_tags)
+        return table
+
+    def add(self, tag, filename):
+        file_num = self._filename_nums.get(filename)
+        if file_num is None:
+            file_num = self._filename_nums[filename] = len(self._filenames)
+            self._filenames.append(filename)
+            self._htmlfilenames.append(self._htmlfilename(filename))
+        tag_num = self._index.get(tag)
+        if tag_num is None:
+            self._index[tag] = len(self._tags)
+            self._tags.append(tag)
+            self._file_nums.append(file_num)
+            self._html.extend((None, None, None, None))
+        else:
+            self._file_nums[tag_num] = file_num
+            self._html[4 * tag_num : 4 * tag_num + 4] = (None, None, None, None)
+
+    def remove(self, tag):
+        """Remove 'tag', if present."""
+        if (tag_num := self._index.pop(tag, None)) is None:
+            return
+        # Move the last tag into the removed tag's place, to keep the arrays dense
+        last_num = len(self._tags) - 1
+        if tag_num != last_num:
+            last_tag = self._tags[last_num]
+            self._index[last_tag] = tag_num
+            self._tags[tag_num] = last_tag
+            self._file_nums[tag_num] = self._file_nums[last_num]
+            self._html[4 * tag_num : 4 * tag_num + 4] = self._html[4 * last_num :]
+        self._tags.pop()
+        self._file_nums.pop()
+        del self._html[4 * last_num :]
+
+    def file_tags(self, filename):
+        """Return the list of tags defined in the file 'filename'."""
+        if (file_num := self._filename_nums.get(filename)) is None:
+            return []
+        return [
+            tag
+            for tag, num in zip(self._tags, self._file_nums, strict=True)
+            if num == file_num
+        ]
+
+    def filename(self, tag):
+        """Return the name of the file that defines 'tag', or None."""
+        if (tag_num := self._index.get(tag)) is None:
+            return None
+        return self._filenames[self._file_nums[tag_num]]
+
+    def link_html(self, tag, curr_filename, is_pipe):
+        """
+        Return the HTML for a link to 'tag' from the file 'curr_filename', or None if
+        there is no such tag.
+        """
+        if (tag_num := self._index.get(tag)) is None:
+            return None
+        file_num = self._file_nums[tag_num]
+        is_same_doc = self._filenames[file_num] == curr_filename
+        variant = 4 * tag_num + 2 * is_pipe + is_same_doc
+        if (link := self._html[variant]) is None:
+            if is_pipe:
+                cssclass = "l"
+            elif m := RE_LINKWORD.match(tag):
+                # option, key or special, depending on which group matched
+                cssclass = "oks"[m.lastindex - 1]
+            else:
+                cssclass = "d"
+            link = self._html[variant] = (
+                f'<a href="{self._href(tag, file_num, is_same_doc)}" '
+                f'class="{cssclass}">{_html_escape(tag)}</a>'
+            )
+        return link
+
+    def num_links(self):
+        """Return the number of link HTML variants built so far."""
+        return len(self._html) - self._html.count(None)
+
+    def sorted_tag_href_pairs(self):
+        result = [
+            (tag, self._href(tag, file_num, is_same_doc=False))
+            for tag, file_num in zip(self._tags, self._file_nums, strict=True)
+        ]
+        result.sort()
+        return result
+
+    def _href(self, tag, file_num, is_same_doc):
+        htmlfilename = self._htmlfilenames[file_num]
+        if tag == "help-tags" and self._filenames[file_num] == "tags":
+            return htmlfilename
+        doc = "" if is_same_doc else htmlfilename
+        return f"{doc}#{urllib.parse.quote_plus(tag)}"
+
 
 # Concealed chars in Vim still count towards hard tabs' spacing calculations even though
 # they are hidden. We need to count them so we can insert that many spaces before we
@@ -165,58 +395,259 @@ class TabFixer:
         return text
 
 
+class LineCounter:
+    """
+    Tokenizer (see 'VimH2H._iter_content') that translates nothing, but counts the
+    lines it is called for.
+    """
+
+    def __init__(self):
+        self.num_lines = 0
+
+    def __call__(self, line, filename, out):
+        self.num_lines += 1
+
+
+# Line classification and tokenization strategies for 'VimH2H.to_html'. Both engines
+# must produce identical output; 'scripts/h2h_compare.py' checks that they do.
+class RegexEngine:
+    """Reference engine: anchored regexes for each line, RE_TAGWORD for each token."""
+
+    @staticmethod
+    def is_eg_end(line):
+        return RE_EG_END.match(line) is not None
+
+    @staticmethod
+    def is_hrule(line):
+        return RE_HRULE.match(line) is not None
+
+    @staticmethod
+    def is_hrule1(line):
+        return RE_HRULE1.match(line) is not None
+
+    @staticmethod
+    def eg_start(line):
+        """Return the part of 'line' before an example start marker, or None."""
+        if m := RE_EG_START.match(line):
+            return m.group(1) or ""
+        return None
+
+    @staticmethod
+    def section(line):
+        return RE_SECTION.match(line)
+
+    @staticmethod
+    def tokenizer(h2h):
+        return h2h._tokenize_regex
+
+
+class LexerEngine:
+    """
+    Classifies each line with cheap string tests, only falling back to the anchored
+    regexes where those tests cannot decide, and handles lines consisting only of plain
+    words without going through RE_TAGWORD.
+    """
+
+    @staticmethod
+    def is_eg_end(line):
+        return line != "" and line[0] not in " \t"
+
+    @staticmethod
+    def is_hrule(line):
+        start = line[:3]
+        return start in ("===", "---") and len(line) >= 6 and line.endswith(start)
+
+    @staticmethod
+    def is_hrule1(line):
+        return len(line) >= 6 and line.startswith("===") and line.endswith("===")
+
+    @staticmethod
+    def eg_start(line):
+        """Return the part of 'line' before an example start marker, or None."""
+        if not line.endswith(EG_START_SUFFIXES):
+            return None
+        pos = line.rfind(">")
+        if pos == 0 or line[pos - 1] == " ":
+            return line[:pos]
+        return None
+
+    @staticmethod
+    def section(line):
+        if line[:1] in SECTION_START_CHARS:
+            return RE_SECTION.match(line)
+        return None
+
+    @staticmethod
+    def tokenizer(h2h):
+        return h2h._tokenize_lexer
+
+
+ENGINES = {"regex": RegexEngine, "lexer": LexerEngine}
+
+
 class VimH2H:
-    def __init__(self, mode="online", project="vim", version=None, tags=None):
+    def __init__(
+        self,
+        mode="online",
+        project="vim",
+        version=None,
+        tags=None,
+        engine="lexer",
+        tag_index=None,
+        escape_cache_size=ESCAPE_CACHE_SIZE,
+        static_path=None,
+        compact=False,
+        profile=False,
+    ):
+        """
+        'tags' is the contents of a Vim tags file. Alternatively, 'tag_index' is the
+        result of an earlier 'tag_index()' call, which is much faster to load; it
+        includes all tags added with 'add_tags'. ValueError is raised if 'tag_index'
+        is invalid or of an outdated format.
+        'escape_cache_size' bounds the number of HTML-escaped strings cached by this
+        translator (None for no bound).
+        'static_path' maps the name of a static asset to the URL that pages refer to
+        it by (default: the name itself, i.e. a relative URL).
+        If 'compact' is true, the content is made smaller without changing how it
+        looks: attribute values are unquoted where possible, class "l" (which has no
+        style of its own) is dropped, and runs of lines that consist of a span of the
+        same class, such as examples, are merged into one span. See 'compact_savings'.
+        If 'profile' is true, the translator collects the data returned by
+        'profile_stats'. Otherwise, it does not spend any time on that.
+        """
+        # All caches belong to this translator instance, so they go away with it.
+        self._html_escape = functools.lru_cache(maxsize=escape_cache_size)(_html_escape)
+        self._incremental_stats = {"reused": 0, "translated": 0}
+        self._compact = compact
+        self._compact_savings = {}
         self._mode = mode
+        self._engine = ENGINES[engine]
         self._project = PROJECTS[project]
         self._version = version
-        self._urls = {}
-        if tags is not None:
-            for line in RE_NEWLINE.split(tags):
-                if m := RE_TAGLINE.match(line):
-                    tag, filename = m.group(1, 2)
-                    self.do_add_tag(filename, tag)
-        if self._project == VimProject:
-            self._urls["help-tags"] = Link("tags", "tags.html", "help-tags")
-
-    def __del__(self):
-        Link.href.cache_clear()
-        Link.html.cache_clear()
+        self._static_path = static_path
+        self._page_skeletons = {}
+        self._profile = None
+        if profile:
+            self._profile = {
+                "phases": dict.fromkeys(PROFILE_PHASES, 0.0),
+                "tokens": dict.fromkeys(TOKEN_NAMES, 0),
+                "links": {"hits": 0, "misses": 0},
+                "files": {},
+            }
+        with self._timer("tags_parse"):
+            if tag_index is not None:
+                self._tags = TagTable.from_bytes(tag_index, self.htmlfilename)
+            else:
+                self._tags = TagTable(self.htmlfilename)
+            if tags is not None:
+                for line in RE_NEWLINE.split(tags):
+                    if m := RE_TAGLINE.match(line):
+                        tag, filename = m.group(1, 2)
+                        self.do_add_tag(filename, tag)
+            if self._project == VimProject:
+                self._tags.add("help-tags", "tags")
 
     def add_tags(self, filename, contents):
+        with self._timer("extract_tags"):
+            tags = self.extract_tags(contents)
+        self.add_tag_list(filename, tags)
+
+    def add_tag_list(self, filename, tags):
+        with self._timer("add_tags"):
+            for tag in tags:
+                self.do_add_tag(filename, tag)
+
+    @staticmethod
+    def extract_tags(contents):
+        """
+        Return the list of tags defined in a help file with the given contents, which
+        may be a string or UTF-8 encoded bytes.
+        """
+        tags = []
         in_example = False
-        for line in RE_NEWLINE.split(contents):
+        for line in _iter_lines(contents):
             if in_example:
                 if RE_EG_END.match(line):
                     in_example = False
                 else:
                     continue
             for anchor in RE_STARTAG.finditer(line):
-                tag = anchor.group(1)
-                self.do_add_tag(filename, tag)
+                tags.append(anchor.group(1))
             if RE_EG_START.match(line):
                 in_example = True
+        return tags
 
     def do_add_tag(self, filename, tag):
-        self._urls[tag] = Link(filename, self.htmlfilename(filename), tag)
+        self._tags.add(tag, filename)
+
+    def remove_tag_list(self, filename, tags):
+        """Remove those of 'tags' that are defined in the file 'filename'."""
+        with self._timer("add_tags"):
+            for tag in tags:
+                if self._tags.filename(tag) == filename:
+                    self._tags.remove(tag)
+
+    def file_tags(self, filename):
+        """Return the list of tags defined in the file 'filename'."""
+        return self._tags.file_tags(filename)
+
+    def tag_index(self):
+        return self._tags.to_bytes()
+
+    def cache_stats(self):
+        """Return counters describing this translator's caches, e.g. for logging."""
+        escape_info = self._html_escape.cache_info()
+        return {
+            "escape": {
+                "hits": escape_info.hits,
+                "misses": escape_info.misses,
+                "size": escape_info.currsize,
+                "maxsize": escape_info.maxsize,
+            },
+            "links": {
+                "tags": len(self._tags),
+                "size": self._tags.num_links(),
+            },
+            "incremental": dict(self._incremental_stats),
+        }
+
+    def compact_savings(self):
+        """
+        Return a dict mapping the name of each file translated in compact mode to the
+        number of bytes that compact mode saved on it.
+        """
+        return dict(self._compact_savings)
+
+    def profile_stats(self):
+        """
+        Return the profiling data collected so far (None unless this translator was
+        created with profile=True), as a JSON-serializable dict:
+        - "phases": total seconds spent parsing the tags file or tag index, extracting
+          tags from help files, adding tags, translating files (which includes
+          rendering the page around each) and rendering the page around each file
+        - "tokens": number of RE_TAGWORD matches of each kind in the translated files
+        - "links": number of tag lookups that found a tag or did not
+        - "files": seconds spent translating each file, and its size in bytes before
+          and after
+        The tokens and links are counted in a separate pass after translating each
+        file, which is not included in the timings.
+        """
+        if self._profile is None:
+            return None
+        return copy.deepcopy(self._profile)
 
     def sorted_tag_href_pairs(self):
-        result = [
-            (tag, link.href(is_same_doc=False)) for tag, link in self._urls.items()
-        ]
-        result.sort()
-        return result
+        return self._tags.sorted_tag_href_pairs()
 
     def maplink(self, tag, curr_filename, css_class=None):
-        links = self._urls.get(tag)
-        if links is not None:
-            is_pipe = css_class == "l"
-            is_same_doc = links.filename == curr_filename
-            return links.html(is_pipe, is_same_doc)
+        if (
+            link := self._tags.link_html(tag, curr_filename, css_class == "l")
+        ) is not None:
+            return link
         elif css_class is not None:
-            return f'<span class="{css_class}">{_html_escape(tag)}</span>'
+            return f'<span class="{css_class}">{self._html_escape(tag)}</span>'
         else:
-            return _html_escape(tag)
+            return self._html_escape(tag)
 
     def synthesize_tag(self, curr_filename, text):
         def xform(c):
@@ -231,8 +662,7 @@ class VimH2H:
         tag = base_tag
         i = 0
         while True:
-            link = self._urls.get(tag)
-            if link is None or link.filename != curr_filename:
+            if self._tags.filename(tag) != curr_filename:
                 return tag
             tag = f"{base_tag}_{i}"
             i += 1
@@ -245,46 +675,415 @@ class VimH2H:
 
     @staticmethod
     def prelude(theme):
-        return flask.render_template("prelude.html", theme=theme)
+        return render_template("prelude.html", theme=theme)
 
     def to_html(self, filename, contents):
+        if self._profile is None:
+            return self._to_html(filename, contents)
+        start = time.perf_counter()
+        result = self._to_html(filename, contents)
+        seconds = time.perf_counter() - start
+        self._profile_file(filename, contents, seconds, len(result.encode()))
+        return result
+
+    def _to_html(self, filename, contents):
+        sidebar_headings = []
+        content = self._iter_content(filename, contents, sidebar_headings)
+        if self._compact:
+            content = self._compact_content(filename, content)
+        content = "".join(content)
+        head, tail = self._render_page(filename, sidebar_headings)
+        return head + content + tail
+
+    def iter_html(self, filename, contents, previous=None, sections=None, info=None):
+        """
+        Translate like 'to_html', but yield the result as a sequence of UTF-8 encoded
+        chunks of bounded size, so that the whole page never needs to be in memory at
+        once. Since the sidebar precedes the content, this first makes a cheap pass
+        over 'contents' that only classifies lines, to collect the sidebar headings.
+
+        'contents' may be a string or UTF-8 encoded bytes; bytes are decoded line by
+        line as the translation goes, rather than all at once.
+
+        If 'info' is a dict, it is filled in once all chunks have been yielded with
+        what is needed to pass this translation as 'previous' later on: "refs", the set
+        of texts that the translator looked up as tags, and "num_lines", the number of
+        lines it tokenized. 'translation_key(info["refs"])' then identifies everything
+        apart from the text of its lines that the translation depends on.
+
+        'previous' may be a '(contents, html, info)' triple holding an earlier version
+        of the same file (a string or bytes, like 'contents'), its translation (an
+        iterable of UTF-8 encoded chunks, which is consumed as the translation goes)
+        and the 'info' filled in when that was made, provided that 'translation_key'
+        of the refs in it is the same for this translator as it was for the one that
+        made it. The lines before the first change and after the last change are then
+        not translated again but reused from there, which makes retranslating a large
+        file after a small change much cheaper. State carried over from one line to
+        the next (such as whether we are in an example) is still tracked for every
+        line, so the result is the same as without 'previous'. The refs of reused
+        lines are not collected again; the refs of 'previous' are taken over instead,
+        which may include some that this file no longer refers to. In compact mode,
+        'previous' is ignored.
+
+        If 'sections' is a list, a section index of the content is appended to it once
+        all chunks have been yielded: the content is divided at line boundaries into
+        sections of about SECTION_BYTES, and for each section, a '(start, end,
+        anchors)' tuple gives its byte range within the page and the ids of the
+        elements in it. Each section is valid HTML on its own.
+        """
+        chunks = self._iter_html(filename, contents, previous, sections, info)
+        if self._profile is not None:
+            chunks = self._profiled_chunks(filename, contents, chunks)
+        return chunks
+
+    def _iter_html(self, filename, contents, previous, sections, info):
+        # A cheap pass that only classifies lines collects the sidebar headings, which
+        # precede the content
+        sidebar_headings = []
+        counter = LineCounter()
+        for _ in self._iter_content(filename, contents, sidebar_headings, counter):
+            pass
+        tokenize = self._engine.tokenizer(self)
+        refs = None
+        if info is not None:
+            refs = set()
+            tokenize = functools.partial(tokenize, refs=refs)
+        if previous is not None and not self._compact:
+            tokenize = self._reusing_tokenizer(
+                filename, *previous, counter.num_lines, tokenize, refs
+            )
+        content = self._iter_content(filename, contents, [], tokenize)
+        if self._compact:
+            content = self._compact_content(filename, content)
+        chunks = (chunk.encode() for chunk in content)
+        head, tail = self._render_page(filename, sidebar_headings)
+        head = head.encode()
+        yield head
+        if sections is not None:
+            chunks = self._index_sections(chunks, sections, len(head))
+        yield from chunks
+        yield tail.encode()
+        if info is not None:
+            info["refs"] = refs
+            info["num_lines"] = counter.num_lines
+
+    def translation_key(self, refs):
+        """
+        Return a key identifying everything apart from the text of its lines that a
+        translation depends on, given the texts that it looked up as tags ('refs', as
+        collected by 'iter_html'): the version and settings of the translator, and
+        which of those texts are defined as tags, and where.
+        """
+        digest = hashlib.sha1()  # noqa: S324
+        digest.update(
+            f"{TRANSLATION_FORMAT_VERSION}:{self._mode}:{self._project.name}:".encode()
+        )
+        if self._compact:
+            digest.update(b"compact:")
+        tag_filename = self._tags.filename
+        for tag in sorted(refs):
+            if (tag_file := tag_filename(tag)) is not None:
+                digest.update(f"{tag}\0{tag_file}\0".encode())
+        return digest.digest()
+
+    def _reusing_tokenizer(
+        self, filename, prev_contents, prev_html, prev_info, num_lines, tokenize, refs
+    ):
+        """
+        Return a tokenizer (see '_iter_content') for a file whose contents have
+        'num_lines' lines to tokenize, that reuses the translations of the lines that
+        it has in common with the start and end of 'prev_contents', as found in
+        'prev_html', its translation, and uses 'tokenize' for the others. Both are
+        consumed in step with the translation, so neither the previous translation nor
+        the line translations taken from it need to be in memory at once. Once a line
+        is reused, the refs in 'prev_info' are added to 'refs' (unless that is None).
+        Return 'tokenize' itself if 'prev_html' cannot be matched up with
+        'prev_contents' line by line.
+        """
+        if filename == "help.txt":
+            # Local additions would break the correspondence of lines
+            return tokenize
+        prev_tokens = self._iter_prev_tokens(filename, prev_contents, prev_html)
+        prev_refs = prev_info["refs"]
+        # Lines are matched up from the start until the first one that differs, and
+        # from the end after that: line 'i' then corresponds to line 'i + shift' of
+        # 'prev_contents'
+        shift = prev_info["num_lines"] - num_lines
+        stats = self._incremental_stats
+        # Number of lines tokenized so far, and of lines taken from 'prev_tokens'
+        num_done = 0
+        num_prev_done = 0
+        in_prefix = True
+
+        def reuse_or_tokenize(line, filename, out):
+            nonlocal num_done, num_prev_done, in_prefix, prev_refs
+            tokens = None
+            while True:
+                prev_i = num_done if in_prefix else num_done + shift
+                if prev_i < num_prev_done:
+                    break
+                prev = next(
+                    itertools.islice(prev_tokens, prev_i - num_prev_done, None), None
+                )
+                num_prev_done = prev_i + 1
+                if prev is not None and prev[0] == line:
+                    tokens = prev[1]
+                    break
+                if not in_prefix:
+                    break
+                in_prefix = False
+            num_done += 1
+            if tokens is not None:
+                out.append(tokens)
+                stats["reused"] += 1
+                if refs is not None and prev_refs is not None:
+                    refs.update(prev_refs)
+                    prev_refs = None
+            else:
+                tokenize(line, filename, out)
+                stats["translated"] += 1
+
+        return reuse_or_tokenize
+
+    def _iter_prev_tokens(self, filename, prev_contents, prev_html):
+        """
+        Generator that yields a '(text, tokens)' pair for each line of 'prev_contents'
+        that '_iter_content' tokenizes: the text it tokenizes, and the translation of
+        that text found in 'prev_html', the translation of 'prev_contents'. Stops
+        early if the two do not match up.
+        """
+        html_lines = _iter_content_lines(prev_html)
+        # Translate 'prev_contents' with a marker in place of each line's tokens, so
+        # that the tokens can be cut out of the corresponding line of 'prev_html'
+        texts = collections.deque()
+
+        def mark_tokens(line, filename, out):
+            texts.append(line)
+            out.append(TOKENS_MARKER)
+
+        pending = ""
+        for chunk in self._iter_content(filename, prev_contents, [], mark_tokens):
+            skeleton_lines = (pending + chunk).split("\n")
+            pending = skeleton_lines.pop()
+            for skeleton_line in skeleton_lines:
+                if (html_line := next(html_lines, None)) is None:
+                    return
+                match skeleton_line.split(TOKENS_MARKER):
+                    case [_]:
+                        if skeleton_line != html_line:
+                            return
+                    case [prefix, suffix]:
+                        if (
+                            len(html_line) < len(prefix) + len(suffix)
+                            or not html_line.startswith(prefix)
+                            or not html_line.endswith(suffix)
+                        ):
+                            return
+                        tokens = html_line[len(prefix) : len(html_line) - len(suffix)]
+                        yield texts.popleft(), tokens
+                    case _:
+                        return
+
+    def _render_page(self, filename, sidebar_headings):
+        """
+        Return the parts of the page for 'filename' before and after its content.
+        """
+        with self._timer("render"):
+            head, tail = self._page_skeleton(filename)
+            slots = {
+                "filename": markupsafe.escape(filename),
+                "sidebar": _sidebar_html(sidebar_headings),
+            }
+            return _fill_page_slots(head, slots), _fill_page_slots(tail, slots)
+
+    def _timer(self, phase):
+        """
+        Return a context manager that adds the time spent in it to 'phase' of the
+        profiling data, if profiling.
+        """
+        if self._profile is None:
+            return contextlib.nullcontext()
+        return _timed(self._profile["phases"], phase)
+
+    def _profiled_chunks(self, filename, contents, chunks):
+        """
+        Generator that yields 'chunks' (as yielded by '_iter_html') and records the
+        profiling data of the file once done. Only the time spent producing the chunks
+        counts, not the time that the caller spends between them.
+        """
+        seconds = 0.0
+        size = 0
+        start = time.perf_counter()
+        for chunk in chunks:
+            seconds += time.perf_counter() - start
+            size += len(chunk)
+            yield chunk
+            start = time.perf_counter()
+        seconds += time.perf_counter() - start
+        self._profile_file(filename, contents, seconds, size)
+
+    def _profile_file(self, filename, contents, seconds, bytes_out):
+        profile = self._profile
+        profile["phases"]["translate"] += seconds
+        profile["files"][filename] = {
+            "seconds": seconds,
+            "bytes_in": len(contents)
+            if isinstance(contents, bytes)
+            else len(contents.encode()),
+            "bytes_out": bytes_out,
+        }
+
+        tokens = profile["tokens"]
+        links = profile["links"]
+        tag_filename = self._tags.filename
+
+        def count_tokens(line, filename, out):
+            for match in RE_TAGWORD.finditer(line):
+                kind = match.lastindex
+                tokens[TOKEN_NAMES[kind - 1]] += 1
+                if kind in LINK_TOKENS:
+                    if tag_filename(match[kind]) is not None:
+                        links["hits"] += 1
+                    else:
+                        links["misses"] += 1
+
+        for _ in self._iter_content(filename, contents, [], count_tokens):
+            pass
+
+    def _page_skeleton(self, filename):
+        """
+        Return page.html rendered with placeholders for the per-file parts, as two
+        lists of the parts before and after the content. Each list alternates between
+        static text and the names of slots to fill in. Only help.txt gets a different
+        page from all other files, so there are at most two skeletons.
+        """
+        is_help_txt = filename == "help.txt"
+        if (skeleton := self._page_skeletons.get(is_help_txt)) is None:
+            page = render_template(
+                "page.html",
+                static_path=self._static_path,
+                mode=self._mode,
+                project=self._project,
+                version=self._version,
+                filename=filename if is_help_txt else "\0filename\0",
+                helptxt=self.htmlfilename("help.txt"),
+                sidebar=markupsafe.Markup("\0sidebar\0"),
+                content=markupsafe.Markup("\0content\0"),
+            )
+            parts = RE_PAGE_SLOT.split(page)
+            i = parts.index("content")
+            skeleton = self._page_skeletons[is_help_txt] = parts[:i], parts[i + 1 :]
+        return skeleton
+
+    def _compact_content(self, filename, chunks):
+        """
+        Generator that yields each of 'chunks' (as yielded by '_iter_content') in
+        compact form, and records the bytes saved once done.
+        """
+        saved = 0
+        pending = ""
+        for chunk in chunks:
+            # A run of spans to merge can only continue past a line break that follows
+            # "</span>", so compact up to the last line break that does not, and keep
+            # the rest for the next chunk. This keeps the result independent of where
+            # the chunks are split.
+            pending += chunk
+            cut = len(pending)
+            while (cut := pending.rfind("\n", 0, cut)) != -1:
+                if not pending.endswith("</span>", 0, cut):
+                    break
+            if cut == -1:
+                continue
+            done, pending = pending[: cut + 1], pending[cut + 1 :]
+            compacted = _compact_html(done)
+            # Compacting only ever removes ASCII characters
+            saved += len(done) - len(compacted)
+            yield compacted
+        compacted = _compact_html(pending)
+        saved += len(pending) - len(compacted)
+        yield compacted
+        self._compact_savings[filename] = saved
+
+    def _index_sections(self, chunks, sections, offset):
+        """
+        Generator that yields 'chunks' (the encoded content, as yielded by
+        '_iter_content', which always ends chunks at the end of a line), and appends
+        the section index to 'sections' once done; see 'iter_html'. 'offset' is the
+        byte offset of the content within the page.
+        """
+        start = offset
+        anchors = []
+        for chunk in chunks:
+            pos = 0
+            while (cut := start + SECTION_BYTES - offset) < len(chunk):
+                if (cut := _section_cut(chunk, max(cut, pos))) == -1:
+                    break
+                anchors += (a.decode() for a in RE_ANCHOR.findall(chunk, pos, cut))
+                sections.append((start, offset + cut, anchors))
+                start = offset + cut
+                anchors = []
+                pos = cut
+            anchors += (a.decode() for a in RE_ANCHOR.findall(chunk, pos))
+            offset += len(chunk)
+            yield chunk
+        if offset > start or len(sections) == 0:
+            sections.append((start, offset, anchors))
+
+    def _iter_content(self, filename, contents, sidebar_headings, tokenize=None):
+        """
+        Generator that yields the translation of 'contents' (without the surrounding
+        page) as a sequence of strings, and fills in 'sidebar_headings' as it goes.
+        'tokenize(line, filename, out)' is called to translate the text of each line
+        that is not an example or horizontal rule, appending to list 'out'; it defaults
+        to the engine's tokenizer.
+        """
+        engine = self._engine
+        if tokenize is None:
+            tokenize = engine.tokenizer(self)
+        escape = self._html_escape
         is_help_txt = filename == "help.txt"
-        lines = [line.rstrip("\r\n") for line in RE_NEWLINE.split(contents)]
 
         out = []
-        sidebar_headings = []
+        num_out_lines = 0
         sidebar_lvl = 2
         in_example = False
-        for idx, line in enumerate(lines):
-            prev_line = "" if idx == 0 else lines[idx - 1]
-            if prev_line == "" and idx > 1:
-                prev_line = lines[idx - 2]
+        # The last two lines, for looking back past a blank line
+        prev_lines = ("", "")
+        for line in _iter_lines(contents):
+            if len(out) >= STREAM_CHUNK_PIECES or num_out_lines >= STREAM_CHUNK_LINES:
+                yield "".join(out)
+                out = []
+                num_out_lines = 0
+            num_out_lines += 1
+
+            prev_line = prev_lines[1] or prev_lines[0]
+            prev_lines = (prev_lines[1], line)
 
             if in_example:
-                if RE_EG_END.match(line):
+                if engine.is_eg_end(line):
                     in_example = False
                     if line[0] == "<":
                         line = line[1:]
                 else:
-                    out.extend(('<span class="e">', _html_escape(line), "</span>\n"))
+                    out.extend(('<span class="e">', escape(line), "</span>\n"))
                     continue
 
-            if RE_HRULE.match(line):
-                out.extend(('<span class="h">', _html_escape(line), "</span>\n"))
+            if engine.is_hrule(line):
+                out.extend(('<span class="h">', escape(line), "</span>\n"))
                 continue
 
-            if m := RE_EG_START.match(line):
+            if (eg_prefix := engine.eg_start(line)) is not None:
                 in_example = True
-                line = m.group(1) or ""
+                line = eg_prefix
 
             heading = None
             skip_to_col = None
-            if m := RE_SECTION.match(line):
+            if m := engine.section(line):
                 heading = m.group(1)
                 heading_lvl = 2
                 out.extend(('<span class="c">', heading, "</span>"))
                 skip_to_col = m.end(1)
-            elif RE_HRULE1.match(prev_line) and (m := RE_HEADING.match(line)):
+            elif engine.is_hrule1(prev_line) and (m := RE_HEADING.match(line)):
                 heading = m.group(1)
                 heading_lvl = 1
 
@@ -292,7 +1091,7 @@ class VimH2H:
             if heading is not None and sidebar_lvl >= heading_lvl:
                 if sidebar_lvl > heading_lvl:
                     sidebar_lvl = heading_lvl
-                    sidebar_headings = []
+                    sidebar_headings.clear()
                 if m := RE_STARTAG.search(line):
                     tag = m.group(1)
                 else:
@@ -301,69 +1100,16 @@ class VimH2H:
                     span_opened = True
                 tag_escaped = urllib.parse.quote_plus(tag)
                 sidebar_headings.append(
-                    markupsafe.Markup(
-                        f'<a href="#{tag_escaped}">{_html_escape(heading)}</a>'
-                    )
+                    markupsafe.Markup(f'<a href="#{tag_escaped}">{escape(heading)}</a>')
                 )
 
             if skip_to_col is not None:
                 line = line[skip_to_col:]
 
             is_local_additions = is_help_txt and RE_LOCAL_ADD.match(line)
-            lastpos = 0
 
-            tab_fixer = TabFixer()
+            tokenize(line, filename, out)
 
-            for match in RE_TAGWORD.finditer(line):
-                pos = match.start()
-                if pos > lastpos:
-                    out.append(_html_escape(tab_fixer.fix_tabs(line[lastpos:pos])))
-                lastpos = match.end()
-                # fmt: off
-                (header, graphic, pipeword, starword, command, opt, ctrl, special,
-                 title, note, url, word) = match.groups()
-                # fmt: on
-                if pipeword is not None:
-                    out.append(self.maplink(pipeword, filename, "l"))
-                    tab_fixer.incr_concealed_chars(2)
-                elif starword is not None:
-                    out.extend(
-                        (
-                            '<span id="',
-                            urllib.parse.quote_plus(starword),
-                            '" class="t">',
-                            _html_escape(starword),
-                            "</span>",
-                        )
-                    )
-                    tab_fixer.incr_concealed_chars(2)
-                elif command is not None:
-                    out.extend(('<span class="e">', _html_escape(command), "</span>"))
-                    tab_fixer.incr_concealed_chars(2)
-                elif opt is not None:
-                    out.append(self.maplink(opt, filename, "o"))
-                elif ctrl is not None:
-                    out.append(self.maplink(ctrl, filename, "k"))
-                elif special is not None:
-                    out.append(self.maplink(special, filename, "s"))
-                elif title is not None:
-                    out.extend(('<span class="i">', _html_escape(title), "</span>"))
-                elif note is not None:
-                    out.extend(('<span class="n">', _html_escape(note), "</span>"))
-                elif header is not None:
-                    out.extend(
-                        ('<span class="h">', _html_escape(header[:-1]), "</span>")
-                    )
-                elif graphic is not None:
-                    out.append(_html_escape(graphic[:-2]))
-                elif url is not None:
-                    out.extend(
-                        ('<a class="u" href="', url, '">', _html_escape(url), "</a>")
-                    )
-                elif word is not None:
-                    out.append(self.maplink(word, filename))
-            if lastpos < len(line):
-                out.append(_html_escape(tab_fixer.fix_tabs(line[lastpos:])))
             if span_opened:
                 out.append("</span>")
             out.append("\n")
@@ -371,18 +1117,275 @@ class VimH2H:
             if is_local_additions:
                 out.append(self._project.local_additions)
 
-        return flask.render_template(
-            "page.html",
-            mode=self._mode,
-            project=self._project,
-            version=self._version,
-            filename=filename,
-            helptxt=self.htmlfilename("help.txt"),
-            content=markupsafe.Markup("".join(out)),
-            sidebar_headings=sidebar_headings,
-        )
+        yield "".join(out)
+
+    def _tokenize_regex(self, line, filename, out, refs=None):
+        # If 'refs' is a set, the texts looked up as tags are added to it
+        escape = self._html_escape
+        lastpos = 0
+
+        tab_fixer = TabFixer()
+
+        for match in RE_TAGWORD.finditer(line):
+            pos = match.start()
+            if pos > lastpos:
+                out.append(escape(tab_fixer.fix_tabs(line[lastpos:pos])))
+            lastpos = match.end()
+            if refs is not None and (kind := match.lastindex) in LINK_TOKENS:
+                refs.add(match[kind])
+            # fmt: off
+            (header, graphic, pipeword, starword, command, opt, ctrl, special,
+             title, note, url, word) = match.groups()
+            # fmt: on
+            if pipeword is not None:
+                out.append(self.maplink(pipeword, filename, "l"))
+                tab_fixer.incr_concealed_chars(2)
+            elif starword is not None:
+                out.extend(
+                    (
+                        '<span id="',
+                        urllib.parse.quote_plus(starword),
+                        '" class="t">',
+                        escape(starword),
+                        "</span>",
+                    )
+                )
+                tab_fixer.incr_concealed_chars(2)
+            elif command is not None:
+                out.extend(('<span class="e">', escape(command), "</span>"))
+                tab_fixer.incr_concealed_chars(2)
+            elif opt is not None:
+                out.append(self.maplink(opt, filename, "o"))
+            elif ctrl is not None:
+                out.append(self.maplink(ctrl, filename, "k"))
+            elif special is not None:
+                out.append(self.maplink(special, filename, "s"))
+            elif title is not None:
+                out.extend(('<span class="i">', escape(title), "</span>"))
+            elif note is not None:
+                out.extend(('<span class="n">', escape(note), "</span>"))
+            elif header is not None:
+                out.extend(('<span class="h">', escape(header[:-1]), "</span>"))
+            elif graphic is not None:
+                out.append(escape(graphic[:-2]))
+            elif url is not None:
+                out.extend(('<a class="u" href="', url, '">', escape(url), "</a>"))
+            elif word is not None:
+                out.append(self.maplink(word, filename))
+        if lastpos < len(line):
+            out.append(escape(tab_fixer.fix_tabs(line[lastpos:])))
+
+    def _tokenize_lexer(self, line, filename, out, refs=None):
+        # If 'refs' is a set, the texts looked up as tags are added to it
+        link_html = self._tags.link_html
+        escape = self._html_escape
+
+        if RE_TOKEN_TRIGGER.search(line) is None:
+            # Fast path: plain words and the separators between them only
+            parts = RE_WORD_SPLIT.split(line)
+            if refs is not None:
+                refs.update(parts[1::2])
+            for i in range(1, len(parts), 2):
+                word = parts[i]
+                if (link := link_html(word, filename, False)) is not None:
+                    parts[i] = link
+                else:
+                    parts[i] = escape(word)
+            out.extend(parts)
+            return
+
+        lastpos = 0
+
+        tab_fixer = TabFixer()
+
+        for match in RE_TAGWORD.finditer(line):
+            pos = match.start()
+            if pos > lastpos:
+                out.append(escape(tab_fixer.fix_tabs(line[lastpos:pos])))
+            lastpos = match.end()
+            kind = match.lastindex
+            text = match[kind]
+            if refs is not None and kind in LINK_TOKENS:
+                refs.add(text)
+            if kind == TOK_WORD:
+                if (link := link_html(text, filename, False)) is not None:
+                    out.append(link)
+                else:
+                    out.append(escape(text))
+            elif kind == TOK_PIPEWORD:
+                out.append(self.maplink(text, filename, "l"))
+                tab_fixer.incr_concealed_chars(2)
+            elif kind == TOK_OPT:
+                out.append(self.maplink(text, filename, "o"))
+            elif kind == TOK_SPECIAL:
+                out.append(self.maplink(text, filename, "s"))
+            elif kind == TOK_STARWORD:
+                out.extend(
+                    (
+                        '<span id="',
+                        urllib.parse.quote_plus(text),
+                        '" class="t">',
+                        escape(text),
+                        "</span>",
+                    )
+                )
+                tab_fixer.incr_concealed_chars(2)
+            elif kind == TOK_COMMAND:
+                out.extend(('<span class="e">', escape(text), "</span>"))
+                tab_fixer.incr_concealed_chars(2)
+            elif kind == TOK_CTRL:
+                out.append(self.maplink(text, filename, "k"))
+            elif kind == TOK_NOTE:
+                out.extend(('<span class="n">', escape(text), "</span>"))
+            elif kind == TOK_TITLE:
+                out.extend(('<span class="i">', escape(text), "</span>"))
+            elif kind == TOK_HEADER:
+                out.extend(('<span class="h">', escape(text[:-1]), "</span>"))
+            elif kind == TOK_GRAPHIC:
+                out.append(escape(text[:-2]))
+            elif kind == TOK_URL:
+                out.extend(('<a class="u" href="', text, '">', escape(text), "</a>"))
+        if lastpos < len(line):
+            out.append(escape(tab_fixer.fix_tabs(line[lastpos:])))
+
+
+def render_template(name, static_path=None, **context):
+    """
+    Render the template 'name' from the templates directory, without requiring a Flask
+    application context. 'static_path' is as for 'VimH2H'.
+    """
+    env = _jinja_env(static_path or _relative_static_path)
+    return env.get_template(name).render(context)
 
 
 @functools.cache
+def _jinja_env(static_path):
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(pathlib.Path(__file__).parent / "templates"),
+        autoescape=jinja2.select_autoescape(),
+        trim_blocks=True,
+        lstrip_blocks=True,
+    )
+    env.filters["static_path"] = static_path
+    return env
+
+
+def _relative_static_path(name):
+    return name
+
+
+def _sidebar_html(sidebar_headings):
+    if not sidebar_headings:
+        return ""
+    items = "".join(f"<li>{h}</li>\n" for h in sidebar_headings)
+    return f'<ul><li><a href="#">↑Top↑</a></li>\n{items}</ul>\n'
+
+
+def _fill_page_slots(parts, slots):
+    # Odd-numbered parts are slot names, as split out by RE_PAGE_SLOT
+    return "".join(slots[part] if i % 2 else part for i, part in enumerate(parts))
+
+
+@contextlib.contextmanager
+def _timed(phases, phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[phase] += time.perf_counter() - start
+
+
+def _compact_html(content):
+    content = RE_COMPACT_UNLINKED.sub(r"\1", content)
+    content = RE_COMPACT_TAG.sub(_compact_tag, content)
+    return RE_COMPACT_RUN.sub(_merge_span_run, content)
+
+
+def _compact_tag(m):
+    return RE_COMPACT_QUOTED.sub(r"=\1", m[0].replace(' class="l"', ""))
+
+
+def _merge_span_run(m):
+    return m[0].replace(f"</span>\n<span class={m[1]}>", "\n")
+
+
+def _section_cut(chunk, pos):
+    """
+    Return the offset just after the first line break in 'chunk' at or after 'pos'
+    at which a section can end, or -1 if there is none.
+    """
+    while (pos := chunk.find(b"\n", pos)) != -1:
+        # Only the merged spans of compact mode continue past a line break, and
+        # they contain no other tags, so we are outside any element if the last
+        # tag before the line break (if any in this chunk) is a closing one.
+        tag_start = chunk.rfind(b"<", 0, pos)
+        if tag_start == -1 or chunk.startswith(b"</", tag_start):
+            return pos + 1
+        pos += 1
+    return -1
+
+
+def _iter_lines(contents):
+    """
+    Generator that yields the lines of 'contents' as split by RE_NEWLINE. 'contents'
+    may also be UTF-8 encoded bytes. It is split a block of about SPLIT_BLOCK_SIZE at
+    a time, so that no copy of the whole of it (as a string, or as a list of lines) is
+    made. Blocks end at a "\n", which a UTF-8 multi-byte sequence never contains, so
+    bytes are decoded block by block.
+    """
+    is_bytes = isinstance(contents, bytes)
+    newline = b"\n" if is_bytes else "\n"
+    size = len(contents)
+    pos = 0
+    while True:
+        end = -1
+        if size - pos > SPLIT_BLOCK_SIZE:
+            end = contents.rfind(newline, pos, pos + SPLIT_BLOCK_SIZE)
+            if end == -1:
+                # A single line longer than a block
+                end = contents.find(newline, pos + SPLIT_BLOCK_SIZE)
+        if end == -1:
+            end = size
+        block = contents[pos:end]
+        if is_bytes:
+            block = block.decode()
+        if "\r" in block:
+            yield from RE_NEWLINE.split(block)
+        else:
+            yield from block.split("\n")
+        if end == size:
+            return
+        pos = end + 1
+
+
+def _iter_content_lines(chunks):
+    """
+    Generator that yields the lines of the content of the page made up of the UTF-8
+    encoded 'chunks', starting after CONTENT_START. Lines are cut out of each chunk
+    in turn, without copying the chunk.
+    """
+    start = CONTENT_START.encode()
+    pending = b""
+    is_started = False
+    for chunk in chunks:
+        pos = 0
+        if not is_started:
+            if pending:
+                chunk = pending + chunk
+            if (pos := chunk.find(start)) == -1:
+                pending = chunk
+                continue
+            pending = b""
+            pos += len(start)
+            is_started = True
+        while (end := chunk.find(b"\n", pos)) != -1:
+            yield (pending + chunk[pos:end]).decode()
+            pending = b""
+            pos = end + 1
+        pending += chunk[pos:]
+    if is_started:
+        yield pending.decode()
+
+
 def _html_escape(s):
     return html.escape(s, quote=False)
@@ -1,6 +1,13 @@
 # Retrieve a help page from the data store, and present to the user
 
+import datetime
+import functools
+import gzip
+import json
 import logging
+import re
+import sys
+import zlib
 from http import HTTPStatus
 
 import flask
@@ -8,9 +15,32 @@ import werkzeug.exceptions
 
 from google.cloud import ndb
 
+from . import assets
 from . import dbmodel
+from . import dcz
 from . import vimh2h
 
+# Placeholder for the content that is left out of the lazy version of a page; see
+# 'handle_vimhelp'
+# Holds the page's ETag, which vimhelp.js passes on when it requests the rest
+LAZY_PLACEHOLDER = b'<span id="vh-lazy" data-etag="%s"></span>'
+
+# Element ids are always made by 'urllib.parse.quote_plus'
+RE_ANCHOR = re.compile(r"[-\w.~%+]+", re.ASCII)
+
+# Keys of the parts of each page as of when it was last retrieved, by the key name of
+# its 'ProcessedFileHead'; see 'get_page'
+_part_keys = {}
+
+# Possible values of the "theme" cookie, with None meaning the native theme
+THEMES = None, "light", "dark"
+
+
+def init():
+    # Render the prelude for each theme up front, rather than on the first requests
+    for theme in THEMES:
+        gzip_prelude(theme)
+
 
 def handle_vimhelp(filename, cache):
     req = flask.request
@@ -26,74 +56,426 @@ def handle_vimhelp(filename, cache):
         return redirect(f"{filename}.txt.html")
 
     theme = req.cookies.get("theme")
-    if theme not in ("light", "dark"):
+    if theme not in THEMES:
         theme = None
 
-    if entry := cache.get(project, filename):
+    # A large page is divided into sections. Clients that run vimhelp.js set the "lazy"
+    # cookie, and get the page without the content after its first section (the "lazy"
+    # version). The script then requests the section containing the element that the
+    # URL fragment refers to ("?anchor=..."), and finally the rest ("?rest"). These
+    # requests pass on the ETag of the page they are for ("&etag=..."); if the page
+    # has changed since, they get a 412 response, and the script reloads the page.
+    if (anchor := req.args.get("anchor")) is not None:
+        if not RE_ANCHOR.fullmatch(anchor):
+            raise werkzeug.exceptions.NotFound()
+        variant = f"anchor={anchor}"
+    elif "rest" in req.args:
+        variant = "rest"
+    elif req.cookies.get("lazy") == "1":
+        variant = "lazy"
+    else:
+        variant = None
+
+    # The full page, its lazy version and the rest are served in a form that the update
+    # job stored them in, if possible: dcz to clients that have the dictionary it was
+    # compressed against, otherwise gzip to clients that accept it; see
+    # 'complete_response' and 'complete_lazy_response'
+    accepts_gzip = req.accept_encodings["gzip"] > 0
+    dcz_dict = dcz.available_dictionary(req) if dcz.enabled() else None
+
+    page = cache.get(project, filename)
+    if page is not None:
         logging.info("serving '%s:%s' from inproc cache", project, filename)
-        head, parts = entry
-        resp = prepare_response(req, head, theme)
-        return complete_response(resp, head, parts, theme)
+    elif cache.disk is not None and (blobs := cache.disk.get(project, filename)):
+        logging.info("serving '%s:%s' from disk cache", project, filename)
+        page = Page.from_blobs(blobs)
+        cache.put(project, filename, page, page.size())
+    if page is not None:
+        if variant is not None and (page.sections is not None or variant != "lazy"):
+            check_lazy_etag(req, page)
+            encoding = choose_encoding(page, accepts_gzip, dcz_dict, variant)
+            resp = prepare_response(req, page, theme, variant, encoding)
+            return complete_lazy_response(resp, page, theme, variant, encoding)
+        encoding = choose_encoding(page, accepts_gzip, dcz_dict)
+        resp = prepare_response(req, page, theme, encoding=encoding)
+        return complete_response(resp, page, theme, encoding)
 
     with dbmodel.ndb_context():
         logging.info("serving '%s:%s' from datastore", project, filename)
-        head = dbmodel.ProcessedFileHead.get_by_id(f"{project}:{filename}")
-        if head is None:
+        head_id = f"{project}:{filename}"
+        # A conditional request will likely get a 304 response, which only takes the
+        # head, so only then is the rest of the page not retrieved along with it
+        is_conditional = bool(req.if_none_match) or req.if_modified_since is not None
+        page = get_page(head_id, with_rest=not is_conditional)
+        if page is None:
             logging.warning("%s:%s not found in datastore", project, filename)
             raise werkzeug.exceptions.NotFound()
-        resp = prepare_response(req, head, theme)
-        parts = []
+        if variant is not None and (page.numsections or variant != "lazy"):
+            check_lazy_etag(req, page)
+            encoding = choose_encoding(page, accepts_gzip, dcz_dict, variant)
+            resp = prepare_response(req, page, theme, variant, encoding)
+            if resp.status_code == HTTPStatus.NOT_MODIFIED:
+                return resp
+            get_rest(head_id, page)
+            cache_page(cache, project, filename, page)
+            return complete_lazy_response(resp, page, theme, variant, encoding)
+        encoding = choose_encoding(page, accepts_gzip, dcz_dict)
+        resp = prepare_response(req, page, theme, encoding=encoding)
         if resp.status_code != HTTPStatus.NOT_MODIFIED:
-            parts = get_parts(head)
-            complete_response(resp, head, parts, theme)
-        if head.numparts == 1 or parts:
-            cache.put(project, filename, (head, parts))
+            get_rest(head_id, page)
+            complete_response(resp, page, theme, encoding)
+        if page.is_complete:
+            cache_page(cache, project, filename, page)
         return resp
 
 
-def prepare_response(req, head, theme):
+def cache_page(cache, project, filename, page):
+    cache.put(project, filename, page, page.size())
+    if cache.disk is not None:
+        cache.disk.put(project, filename, page.etag.decode(), page.to_blobs())
+
+
+class Page:
+    """
+    What it takes to serve a page, taken from its 'ProcessedFileHead' and the related
+    entities (see 'get_page'). This is what gets cached, rather than the entities, so
+    as to only keep the bytes of the page and its encodings, without model overhead.
+    """
+
+    __slots__ = (
+        "datas",
+        "dcz_dict",
+        "encoded",
+        "encoded_sections",
+        "etag",
+        "gzipped",
+        "is_complete",
+        "modified",
+        "numsections",
+        "part_keys",
+        "sections",
+    )
+
+    # Approximate memory overhead of a page, and of each section, beyond their bytes
+    OVERHEAD = 512
+    SECTION_OVERHEAD = 128
+
+    def __init__(self, head):
+        self.etag = head.etag
+        self.modified = head.modified
+        self.part_keys = head.part_keys()
+        if head.part_ids is None:
+            # Generated before parts were content-addressed; its section index and
+            # encodings, if any, were stored in a way that is no longer supported
+            self.numsections = None
+            self.gzipped = False
+            self.dcz_dict = None
+            self.encoded_sections = False
+        else:
+            self.numsections = head.numsections
+            self.gzipped = bool(head.gzipped)
+            self.dcz_dict = head.dcz_dict
+            self.encoded_sections = bool(head.encoded_sections)
+        self.datas = [head.data0]
+        # Section index (None if there is none), and dict mapping content encodings to
+        # the stored encodings of the page, as lists of one or three parts (see
+        # 'ProcessedFileHead.encoded_sections')
+        self.sections = None
+        self.encoded = {}
+        self.is_complete = len(self.part_keys) == 0
+
+    @classmethod
+    def from_blobs(cls, blobs):
+        """Return the complete page that 'to_blobs' returned 'blobs' for."""
+        meta = json.loads(blobs[0])
+        page = cls.__new__(cls)
+        page.etag = meta["etag"].encode()
+        page.modified = datetime.datetime.fromisoformat(meta["modified"])
+        page.numsections = meta["numsections"]
+        page.gzipped = meta["gzipped"]
+        page.dcz_dict = meta["dcz_dict"] and bytes.fromhex(meta["dcz_dict"])
+        page.encoded_sections = meta.get("encoded_sections", False)
+        page.part_keys = []
+        page.sections = meta["sections"]
+        numdatas = meta["numdatas"]
+        page.datas = blobs[1 : numdatas + 1]
+        n = 3 if page.encoded_sections else 1
+        page.encoded = {}
+        for i, encoding in enumerate(meta["encodings"]):
+            start = numdatas + 1 + i * n
+            page.encoded[encoding] = blobs[start : start + n]
+        page.is_complete = True
+        return page
+
+    def to_blobs(self):
+        """
+        Return this (complete) page as a list of byte strings, for 'diskcache'.
+        """
+        meta = {
+            "etag": self.etag.decode(),
+            "modified": self.modified.isoformat(),
+            "numsections": self.numsections,
+            "gzipped": self.gzipped,
+            "dcz_dict": self.dcz_dict and self.dcz_dict.hex(),
+            "encoded_sections": self.encoded_sections,
+            "sections": self.sections,
+            "numdatas": len(self.datas),
+            "encodings": list(self.encoded),
+        }
+        encoded = [blob for parts in self.encoded.values() for blob in parts]
+        return [json.dumps(meta).encode(), *self.datas, *encoded]
+
+    def size(self):
+        """Return the approximate number of bytes that this page takes in memory."""
+        size = self.OVERHEAD + sum(map(len, self.datas))
+        size += sum(sum(map(len, parts)) for parts in self.encoded.values())
+        for _, _, anchors in self.sections or ():
+            size += self.SECTION_OVERHEAD + sum(sys.getsizeof(a) for a in anchors)
+        return size
+
+
+def choose_encoding(page, accepts_gzip, dcz_dict, variant=None):
+    # The prelude can only be dcz-compressed against the current dictionary, so pages
+    # compressed against an earlier one are not served as dcz. Of the variants, only the
+    # lazy version and the rest have stored encodings, and only if the encodings are
+    # divided into sections.
+    if variant is not None and (
+        variant not in ("lazy", "rest") or not page.encoded_sections
+    ):
+        return None
+    if dcz_dict is not None and dcz_dict == page.dcz_dict == dcz.dict_hash():
+        return "dcz"
+    if accepts_gzip and page.gzipped:
+        return "gzip"
+    return None
+
+
+def prepare_response(req, page, theme, variant=None, encoding=None):
     resp = flask.Response(mimetype="text/html")
-    resp.last_modified = head.modified
+    resp.last_modified = page.modified
     resp.cache_control.max_age = 15 * 60
     resp.vary.add("Cookie")
-    resp.set_etag(head.etag.decode() + (theme or ""))
+    if page.gzipped or page.dcz_dict is not None:
+        resp.vary.add("Accept-Encoding")
+    if page.dcz_dict is not None:
+        resp.vary.add("Available-Dictionary")
+    if dcz.enabled():
+        dict_path = assets.static_path(dcz.DICT_NAME)
+        resp.headers["Link"] = f'<{dict_path}>; rel="compression-dictionary"'
+    etag = page.etag.decode()
+    if variant in (None, "lazy"):
+        etag += theme or ""
+    if variant is not None:
+        etag += f"/{variant}"
+    if encoding is not None:
+        etag += f"-{encoding}"
+    resp.set_etag(etag)
     return resp.make_conditional(req)
 
 
-def complete_response(resp, head, parts, theme):
-    if resp.status_code != HTTPStatus.NOT_MODIFIED:
-        logging.info(
-            "writing %d-part response, modified %s",
-            1 + len(parts),
-            resp.last_modified,
-        )
-        prelude = vimh2h.VimH2H.prelude(theme=theme).encode()
-        resp.data = b"".join((prelude, head.data0, *(p.data for p in parts)))
+def complete_response(resp, page, theme, encoding=None):
+    # If 'encoding' is given, the response consists of the stored encoding of the page
+    # after an encoding of the prelude: a gzip stream may consist of several members,
+    # and a Zstandard one of several frames, which decode to the concatenation of their
+    # contents. Either way, the response body is a list of pieces, which the WSGI server
+    # writes one by one, so that the page is not copied.
+    if resp.status_code == HTTPStatus.NOT_MODIFIED:
+        return resp
+    if encoding is not None:
+        logging.info("writing %s response, modified %s", encoding, resp.last_modified)
+        set_body(resp, [encoded_prelude(theme, encoding), *page.encoded[encoding]])
+        resp.content_encoding = encoding
+        return resp
+    logging.info(
+        "writing %d-part response, modified %s",
+        len(page.datas),
+        resp.last_modified,
+    )
+    set_body(resp, [prelude(theme), *page.datas])
     return resp
 
 
+@functools.cache
+def prelude(theme):
+    return vimh2h.VimH2H.prelude(theme=theme).encode()
+
+
+@functools.cache
+def gzip_prelude(theme):
+    return gzip.compress(prelude(theme), mtime=0)
+
+
+def encoded_prelude(theme, encoding):
+    if encoding == "dcz":
+        return dcz.prelude(prelude(theme))
+    return gzip_prelude(theme)
+
+
+@functools.lru_cache(maxsize=256)
+def encoded_placeholder(etag, encoding):
+    # The lazy placeholder of the page with ETag 'etag', as a gzip member or dcz frame
+    placeholder = LAZY_PLACEHOLDER % etag
+    if encoding == "dcz":
+        return dcz.frame(placeholder)
+    return gzip.compress(placeholder, mtime=0)
+
+
+def check_lazy_etag(req, page):
+    etag = req.args.get("etag")
+    if etag is not None and etag != page.etag.decode():
+        raise werkzeug.exceptions.PreconditionFailed()
+
+
+def complete_lazy_response(resp, page, theme, variant, encoding=None):
+    # If 'encoding' is given (for the lazy version or the rest only; see
+    # 'choose_encoding'), the response consists of stored encodings of the ranges of the
+    # page, like in 'complete_response'
+    if resp.status_code == HTTPStatus.NOT_MODIFIED:
+        return resp
+    sections = page.sections
+    if sections is None:
+        # The page is not divided into sections, so its lazy version is the whole page
+        if variant != "rest":
+            raise werkzeug.exceptions.NotFound()
+        set_body(resp, [])
+        return resp
+    first, rest, tail = split_ranges(sections)
+    if variant == "lazy":
+        ranges = first, tail
+    elif variant == "rest":
+        ranges = (rest,)
+    else:
+        anchor = variant.removeprefix("anchor=")
+        for start, end, anchors in sections:
+            if anchor in anchors:
+                ranges = ((start, end),)
+                break
+        else:
+            raise werkzeug.exceptions.NotFound()
+    logging.info(
+        "writing %s section response, modified %s", variant, resp.last_modified
+    )
+    if encoding is not None:
+        first, rest, tail = page.encoded[encoding]
+        if variant == "lazy":
+            placeholder = encoded_placeholder(page.etag, encoding)
+            pieces = [encoded_prelude(theme, encoding), first, placeholder, tail]
+        elif encoding == "dcz":
+            pieces = [dcz.header(), rest]
+        else:
+            pieces = [rest]
+        set_body(resp, pieces)
+        resp.content_encoding = encoding
+        return resp
+    pieces = get_ranges(page.datas, ranges)
+    if variant == "lazy":
+        first, tail = pieces
+        placeholder = LAZY_PLACEHOLDER % page.etag
+        pieces = [prelude(theme), *first, placeholder, *tail]
+    else:
+        (pieces,) = pieces
+    set_body(resp, pieces)
+    return resp
+
+
+def split_ranges(sections):
+    """
+    Return the '(start, end)' byte ranges that a page with section index 'sections' is
+    served in: the lazy version consists of the first and the last, the rest of the
+    one in between. An end of None means the end of the page.
+    """
+    first_end = sections[0][1]
+    content_end = sections[-1][1]
+    return (0, first_end), (first_end, content_end), (content_end, None)
+
+
+def set_body(resp, pieces):
+    # Like setting 'resp.data' to the concatenation of the list 'pieces', but without
+    # making that concatenation
+    resp.response = pieces
+    resp.content_length = sum(map(len, pieces))
+
+
+def get_ranges(datas, ranges):
+    """
+    Return the given '(start, end)' byte ranges of the page made up of the parts
+    'datas', each as a list of pieces: parts that lie within the range as they are, and
+    memoryviews of those that it cuts, so that nothing is copied. An end of None means
+    the end of the page.
+    """
+    part_len = len(datas[0])
+    page_len = (len(datas) - 1) * part_len + len(datas[-1])
+    result = []
+    for start, end in ranges:
+        stop = page_len if end is None else end
+        pieces = []
+        for i in range(start // part_len, (stop - 1) // part_len + 1):
+            data = datas[i]
+            offset = i * part_len
+            piece_start = max(start - offset, 0)
+            piece_stop = min(stop - offset, len(data))
+            if piece_start == 0 and piece_stop == len(data):
+                pieces.append(data)
+            else:
+                pieces.append(memoryview(data)[piece_start:piece_stop])
+        result.append(pieces)
+    return result
+
+
 def redirect(url):
     logging.info("redirecting %s to %s", flask.request.path, url)
     return flask.redirect(url, HTTPStatus.MOVED_PERMANENTLY)
 
 
-def get_parts(head):
-    # We could alternatively achieve this via an ancestor query (retrieving the head and
-    # its parts simultaneously) to give us strong consistency.
-    if head.numparts == 1:
-        return []
-    logging.info("retrieving %d extra part(s)", head.numparts - 1)
-    head_id = head.key.id()
-    keys = [
-        ndb.Key("ProcessedFilePart", f"{head_id}:{i}") for i in range(1, head.numparts)
-    ]
-    num_tries = 0
-    while True:
-        parts = ndb.get_multi(keys)
-        if all(p.etag == head.etag for p in parts):
-            return sorted(parts, key=lambda p: p.key.string_id())
-        num_tries += 1
-        if num_tries >= 10:
-            logging.error("tried too many times, giving up")
-            raise werkzeug.exceptions.InternalServerError()
-        logging.warning("got differing etags, retrying")
+def get_page(head_id, with_rest):
+    # Returns the 'Page' of the 'ProcessedFileHead' with key name 'head_id', or None if
+    # there is none; if 'with_rest', complete with the rest of its parts (see
+    # 'ProcessedFileHead.part_ids'). These are then retrieved along with the head, in
+    # the same datastore round trip, by assuming that the page still consists of the
+    # parts that '_part_keys' has for it: only a page that has not been retrieved
+    # before, or has changed since, takes another round trip. Parts are never
+    # overwritten, so they are always consistent with the head, however they are
+    # retrieved.
+    head_key = ndb.Key("ProcessedFileHead", head_id)
+    if not with_rest:
+        head = head_key.get()
+        return None if head is None else Page(head)
+    guessed_keys = _part_keys.get(head_id, [])
+    head, *parts = ndb.get_multi([head_key, *guessed_keys])
+    if head is None:
+        return None
+    page = Page(head)
+    found = dict(zip(guessed_keys, parts, strict=True))
+    if missing := [key for key in page.part_keys if key not in found]:
+        logging.info("retrieving %d more part(s)", len(missing))
+        found.update(zip(missing, ndb.get_multi(missing), strict=True))
+    set_rest(head_id, page, [found[key] for key in page.part_keys])
+    return page
+
+
+def get_rest(head_id, page):
+    # Retrieves the rest of 'page' (as retrieved by 'get_page' without it), if any.
+    if page.is_complete:
+        return
+    logging.info("retrieving %d more part(s)", len(page.part_keys))
+    set_rest(head_id, page, ndb.get_multi(page.part_keys))
+
+
+def set_rest(head_id, page, parts):
+    # Completes 'page' with 'parts', as retrieved for 'page.part_keys'
+    if any(p is None for p in parts):
+        logging.error("parts of '%s' are missing", head_id)
+        raise werkzeug.exceptions.InternalServerError()
+    datas = [p.data for p in parts]
+    n = 3 if page.encoded_sections else 1
+    if page.dcz_dict is not None:
+        page.encoded["dcz"] = datas[-n:]
+        del datas[-n:]
+    if page.gzipped:
+        page.encoded["gzip"] = datas[-n:]
+        del datas[-n:]
+    if page.numsections:
+        page.sections = json.loads(zlib.decompress(datas.pop()))
+    page.datas += datas
+    page.is_complete = True
+    _part_keys[head_id] = page.part_keys
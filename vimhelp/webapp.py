@@ -47,6 +47,7 @@ g_is_dev = False
 def create_app() -> flask.Flask:
     from . import assets
     from . import cache
+    from . import diskcache
     from . import robots
     from . import tagsearch
     from . import vimhelp
@@ -56,7 +57,21 @@ def create_app() -> flask.Flask:
 
     logging.basicConfig(level=logging.INFO)
 
-    cache_ = cache.Cache()
+    # The disk cache is opt-in; see 'diskcache.DiskCache'
+    disk_cache = None
+    if disk_dir := os.environ.get("VIMHELP_DISK_CACHE_DIR"):
+        disk_budget = int(
+            os.environ.get("VIMHELP_DISK_CACHE_BUDGET", diskcache.DEFAULT_BUDGET)
+        )
+        try:
+            disk_cache = diskcache.DiskCache(disk_dir, disk_budget)
+        except OSError as e:
+            logging.warning("not using disk cache in %s: %s", disk_dir, e)
+
+    cache_ = cache.Cache(
+        budget=int(os.environ.get("VIMHELP_CACHE_BUDGET", cache.DEFAULT_BUDGET)),
+        disk=disk_cache,
+    )
 
     app = flask.Flask(
         "vimhelp",
@@ -65,16 +80,13 @@ def create_app() -> flask.Flask:
         static_folder=None,
     )
 
-    app.jinja_options["trim_blocks"] = True
-    app.jinja_options["lstrip_blocks"] = True
-    app.jinja_env.filters["static_path"] = assets.static_path
-
     global g_is_dev
     g_is_dev = os.environ.get("VIMHELP_ENV") == "dev"
     if not g_is_dev:
         app.config["PREFERRED_URL_SCHEME"] = "https"
 
-    assets.init(app)
+    assets.init()
+    vimhelp.init()
 
     app.add_url_rule(
         "/clean_assets", view_func=assets.CleanAssetsHandler.as_view("clean_assets")
@@ -82,6 +94,12 @@ def create_app() -> flask.Flask:
     app.add_url_rule(
         "/enqueue_clean_assets", view_func=assets.handle_enqueue_clean_assets
     )
+    app.add_url_rule(
+        "/clean_parts", view_func=update.CleanPartsHandler.as_view("clean_parts")
+    )
+    app.add_url_rule(
+        "/enqueue_clean_parts", view_func=update.handle_enqueue_clean_parts
+    )
 
     bp = flask.Blueprint("bp", "vimhelp", root_path=package_path)
 